@@ -31,6 +31,9 @@ DIRECTORY_POPUP_URI = "mytools.frame:DirectoryPopupMenu"
 TAG_POPUP_IMPLE_NAME = "bookmarks.TagPopupMenu"
 TAG_POPUP_URI = "mytools.frame:TagPopupMenu"
 
+USAGE_POPUP_IMPLE_NAME = "bookmarks.UsagePopupMenu"
+USAGE_POPUP_URI = "mytools.frame:UsagePopupMenu"
+
 DOCUMENT_IMPLE_NAME = EXT_ID
 DOCUMENT_SERVICE_NAMES = (DOCUMENT_IMPLE_NAME, )
 COMMAND_PROTOCOL = "mytools.bookmarks:"
@@ -57,4 +60,12 @@ NAME_TREE_STATE = "TreeState"
 NAME_WINDOW_STATE = "WindowState"
 NAME_DATA_URL = "DataURL"
 NAME_BACKUP_DIRECTORY = "BackupDirectory"
+NAME_AUTO_SAVE_DELAY = "AutoSaveDelay"
+NAME_BACKUP_COUNT = "BackupCount"
+NAME_BACKUP_DAYS = "BackupDays"
+NAME_BACKUP_DELTA = "BackupDelta"
+NAME_MENU_PAGE_SIZE = "MenuPageSize"
+NAME_USAGE_ITEM_COUNT = "UsageItemCount"
+NAME_USE_JOURNAL = "UseJournal"
+NAME_JOURNAL_LIMIT = "JournalLimit"
 
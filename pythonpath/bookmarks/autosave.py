@@ -0,0 +1,161 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+import threading
+
+from bookmarks.tools import MainThreadCallback
+
+
+class AutoSaver(threading.Thread):
+    """ Stores bookmarks after they have not been changed for a while.
+    
+        The snapshot is taken in the main thread, and it is serialized
+        and written in this thread. The modified state is cleared only
+        if no change has been made after the snapshot was taken.
+    """
+    
+    def __init__(self, ctx, manager, delay, saved=None):
+        """ delay in milliseconds, saved is called in the main thread
+            after the bookmarks have been written. """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.manager = manager
+        self.delay = delay / 1000.0
+        self.saved = saved
+        self.condition = threading.Condition()
+        self.requested = None # time of the last request
+        self.snapshot = None # taken in the main thread
+        self.taking = False
+        self.stopped = False
+    
+        self.queue_depth = 0 # requests not yet written
+        self.max_queue_depth = 0
+        self.saves = 0
+        self.failures = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+    
+        self.take_callback = MainThreadCallback(ctx, self._take_snapshot)
+        self.done_callback = MainThreadCallback(ctx, self._done)
+        self.done_snapshot = None
+    
+    def request(self):
+        """ Request to store after the delay. """
+        with self.condition:
+            self.requested = time.time()
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            self.condition.notify()
+    
+    def stop(self):
+        """ Stop the thread without waiting. The current writing is 
+            finished in the thread, the file is replaced at once and 
+            later stores wait it by the lock of the manager. """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+    
+    def get_stats(self):
+        """ Returns dict of counters. """
+        with self.condition:
+            return {
+                "saves": self.saves,
+                "failures": self.failures,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "last_latency": self.last_latency,
+                "max_latency": self.max_latency,
+                "average_latency": self.saves and
+                    self.total_latency / self.saves or 0.0,
+            }
+    
+    def run(self):
+        condition = self.condition
+        while True:
+            with condition:
+                while not self.stopped:
+                    if self.requested is not None and not self.taking:
+                        wait = self.requested + self.delay - time.time()
+                        if wait <= 0:
+                            break
+                        condition.wait(wait)
+                    else:
+                        condition.wait()
+                if self.stopped:
+                    return
+                self.requested = None
+                self.taking = True
+                depth = self.queue_depth
+            self.take_callback.post()
+            with condition:
+                while self.taking and not self.stopped:
+                    condition.wait()
+                snapshot = self.snapshot
+                self.snapshot = None
+            if snapshot is not None:
+                self._write(snapshot, depth)
+            else:
+                # nothing to be written
+                with condition:
+                    self.queue_depth = max(0, self.queue_depth - depth)
+    
+    def _take_snapshot(self):
+        """ Called in the main thread. """
+        snapshot = None
+        try:
+            # entries of the journal should not be taken after stopped
+            if self.manager.modified and not self.stopped:
+                snapshot = self.manager.take_snapshot()
+        finally:
+            with self.condition:
+                self.snapshot = snapshot
+                self.taking = False
+                self.condition.notify()
+    
+    def _write(self, snapshot, depth):
+        start = time.time()
+        state = self.manager.write_snapshot(snapshot)
+        latency = time.time() - start
+        with self.condition:
+            if state:
+                self.saves += 1
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
+                self.total_latency += latency
+                self.queue_depth = max(0, self.queue_depth - depth)
+            else:
+                self.failures += 1
+                # try again after the delay
+                if self.requested is None:
+                    self.requested = time.time()
+            self.done_snapshot = state and snapshot or None
+        if state:
+            self.done_callback.post()
+    
+    def _done(self):
+        """ Called in the main thread after writing. """
+        with self.condition:
+            snapshot = self.done_snapshot
+            self.done_snapshot = None
+        if snapshot is None:
+            return
+        manager = self.manager
+        if manager.last_modified == snapshot.generation:
+            # no change after the snapshot, the generation is kept 
+            # not to rebuild menus
+            manager.modified = False
+        if self.saved and not self.stopped:
+            self.saved()
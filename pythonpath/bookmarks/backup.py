@@ -0,0 +1,345 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import json
+import time
+import zlib
+import struct
+import hashlib
+import tempfile
+import threading
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class BookmarksBackup(object):
+    """ Keeps snapshots of the bookmarks file in the directory.
+    
+        Snapshots are named by the date they are taken. Full snapshots 
+        are gzip files which can be opened as bookmarks or extracted 
+        by any tool. Snapshots can be stored as difference to the 
+        previous one, these are restored by restore. The hash of the 
+        content is kept in the index, the same content is not stored 
+        twice. Old snapshots are removed according to number and age.
+    """
+    
+    INDEX_NAME = "index.json"
+    FULL_EXTENSION = ".json.gz"
+    DELTA_EXTENSION = ".json.delta"
+    DATE_FORMAT = "%Y-%m-%d_%H%M%S"
+    
+    # wbits of zlib to write gzip and to read gzip or zlib
+    GZIP_WBITS = 16 + zlib.MAX_WBITS
+    READ_WBITS = 32 + zlib.MAX_WBITS
+    
+    # header of delta: length of common prefix and suffix
+    DELTA_HEADER = struct.Struct(">QQ")
+    
+    # number of deltas until the next full snapshot
+    MAX_CHAIN = 10
+    
+    def __init__(self, path, max_count=20, max_days=30, use_delta=False, 
+                    prefix="bookmarks"):
+        """ path is the directory for this bookmarks, max_count and
+            max_days are ignored if 0. Names of snapshots start with 
+            prefix. """
+        self.path = path
+        self.prefix = prefix
+        self.max_count = max_count
+        self.max_days = max_days
+        self.use_delta = use_delta
+        self.lock = threading.Lock()
+        self.snapshots = None # list of dict, older first
+    
+    def _index_path(self):
+        return os.path.join(self.path, self.INDEX_NAME)
+    
+    def _load_index(self):
+        if self.snapshots is not None:
+            return
+        self.snapshots = []
+        try:
+            f = open(self._index_path(), "rb")
+            try:
+                snapshots = json.loads(f.read().decode("utf-8"))
+            finally:
+                f.close()
+            if isinstance(snapshots, list):
+                self.snapshots = snapshots
+        except IOError:
+            pass
+        except ValueError as e:
+            print(e)
+    
+    def _write(self, name, data):
+        """ Write data into the directory atomically. """
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp", dir=self.path)
+        try:
+            f = os.fdopen(fd, "wb")
+            try:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            path = os.path.join(self.path, name)
+            if hasattr(os, "replace"):
+                os.replace(tmp_path, path)
+            else:
+                if os.name == "nt" and os.path.exists(path):
+                    os.remove(path)
+                os.rename(tmp_path, path)
+        except:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    
+    def _write_index(self):
+        self._write(self.INDEX_NAME,
+            json.dumps(self.snapshots, sort_keys=True).encode("utf-8"))
+    
+    def _file_name(self, snapshot):
+        if snapshot.get("base"):
+            return snapshot["name"] + self.DELTA_EXTENSION
+        return snapshot["name"] + self.FULL_EXTENSION
+    
+    def _new_name(self, now):
+        """ Returns name not used by other snapshots for the time. """
+        name = "%s_%s" % (self.prefix, 
+            time.strftime(self.DATE_FORMAT, time.localtime(now)))
+        names = set([s.get("name") for s in self.snapshots])
+        new_name = name
+        n = 1
+        while new_name in names:
+            n += 1
+            new_name = "%s_%d" % (name, n)
+        return new_name
+    
+    def get_snapshots(self):
+        """ Returns list of (hash, time, size), older first. """
+        with self.lock:
+            self._load_index()
+            return [(s["hash"], s["time"], s["size"]) for s in self.snapshots]
+    
+    def get_path(self, hash):
+        """ Returns path to the file of the snapshot, which is stored 
+            as difference if it ends with DELTA_EXTENSION. """
+        with self.lock:
+            self._load_index()
+            return os.path.join(self.path, self._file_name(self._find(hash)))
+    
+    def read(self, hash):
+        """ Returns content of the snapshot. """
+        with self.lock:
+            self._load_index()
+            return self._read(hash)
+    
+    def restore(self, hash, path):
+        """ Write content of the snapshot into the file. Compressed 
+            content is written if the file name ends with .gz. """
+        data = self.read(hash)
+        if path.endswith(".gz"):
+            data = self._compress(data)
+        f = open(path, "wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+    
+    def _find(self, hash):
+        for snapshot in self.snapshots:
+            if snapshot["hash"] == hash:
+                return snapshot
+        raise KeyError("Snapshot not found: %s" % hash)
+    
+    def _read(self, hash):
+        # follow bases until a full snapshot
+        chain = []
+        snapshot = self._find(hash)
+        while snapshot.get("base"):
+            chain.append(snapshot)
+            snapshot = self._find(snapshot["base"])
+        data = self._read_file(snapshot)
+        for snapshot in reversed(chain):
+            data = self._apply_delta(data, self._read_file(snapshot))
+        return data
+    
+    def _read_file(self, snapshot):
+        f = open(os.path.join(self.path, self._file_name(snapshot)), "rb")
+        try:
+            return zlib.decompress(f.read(), self.READ_WBITS)
+        finally:
+            f.close()
+    
+    def _compress(self, data):
+        """ Compress data into gzip format. """
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, self.GZIP_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    
+    def _make_delta(self, old, new):
+        """ Difference between old and new as common prefix and suffix
+            with changed part of new. Changes of bookmarks are usually
+            made in a region. """
+        n = min(len(old), len(new))
+        prefix = 0
+        step = 0x1000
+        while prefix < n:
+            size = min(step, n - prefix)
+            if old[prefix:prefix+size] != new[prefix:prefix+size]:
+                if size == 1:
+                    break
+                step = max(1, size // 2)
+                continue
+            prefix += size
+        n -= prefix
+        suffix = 0
+        step = 0x1000
+        while suffix < n:
+            size = min(step, n - suffix)
+            if old[len(old)-suffix-size:len(old)-suffix] != \
+                    new[len(new)-suffix-size:len(new)-suffix]:
+                if size == 1:
+                    break
+                step = max(1, size // 2)
+                continue
+            suffix += size
+        return self.DELTA_HEADER.pack(prefix, suffix) + \
+            new[prefix:len(new)-suffix]
+    
+    def _apply_delta(self, old, delta):
+        size = self.DELTA_HEADER.size
+        prefix, suffix = self.DELTA_HEADER.unpack(delta[:size])
+        return old[:prefix] + delta[size:] + old[len(old)-suffix:]
+    
+    def _chain_length(self, snapshot):
+        n = 0
+        while snapshot.get("base"):
+            n += 1
+            snapshot = self._find(snapshot["base"])
+        return n
+    
+    def add(self, data, now=None):
+        """ Store data as a new snapshot, returns its hash.
+            Nothing is stored if the last snapshot has the same content. """
+        if now is None:
+            now = time.time()
+        hash = hashlib.sha1(data).hexdigest()
+        with self.lock:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            self._load_index()
+            snapshots = self.snapshots
+            if snapshots and snapshots[-1]["hash"] == hash:
+                return hash
+            for snapshot in snapshots:
+                if snapshot["hash"] == hash:
+                    # same content stored before, keep it as the latest
+                    snapshots.remove(snapshot)
+                    snapshot["time"] = now
+                    snapshots.append(snapshot)
+                    self._write_index()
+                    return hash
+            snapshot = {"hash": hash, "time": now, "size": len(data), 
+                "name": self._new_name(now)}
+            content = data
+            if self.use_delta and snapshots:
+                previous = snapshots[-1]
+                if self._chain_length(previous) < self.MAX_CHAIN:
+                    delta = self._make_delta(self._read(previous["hash"]), data)
+                    if len(delta) < len(data):
+                        snapshot["base"] = previous["hash"]
+                        content = delta
+            self._write(self._file_name(snapshot), self._compress(content))
+            snapshots.append(snapshot)
+            self._prune(now)
+            self._write_index()
+            return hash
+    
+    def _prune(self, now):
+        """ Remove old snapshots, the latest one is always kept. """
+        snapshots = self.snapshots
+        n = 0
+        if self.max_count > 0 and len(snapshots) > self.max_count:
+            n = len(snapshots) - self.max_count
+        if self.max_days > 0:
+            limit = now - self.max_days * 86400
+            while n < len(snapshots) - 1 and snapshots[n]["time"] < limit:
+                n += 1
+        if n <= 0:
+            return
+        removed = snapshots[:n]
+        kept = snapshots[n:]
+        removed_hashes = set([s["hash"] for s in removed])
+        # deltas based on removed snapshots are stored as full
+        for snapshot in kept:
+            if snapshot.get("base") in removed_hashes:
+                data = self._read(snapshot["hash"])
+                old_name = self._file_name(snapshot)
+                snapshot.pop("base")
+                self._write(self._file_name(snapshot), self._compress(data))
+                os.remove(os.path.join(self.path, old_name))
+        self.snapshots = kept
+        for snapshot in removed:
+            try:
+                os.remove(os.path.join(self.path, self._file_name(snapshot)))
+            except OSError as e:
+                print(e)
+
+
+class BackupThread(threading.Thread):
+    """ Stores backups in the order of requests. """
+    
+    Thread = None
+    
+    def get():
+        """ Returns running thread shared by bookmarks. """
+        klass = BackupThread
+        if klass.Thread is None or not klass.Thread.is_alive():
+            klass.Thread = klass()
+            klass.Thread.start()
+        return klass.Thread
+    
+    get = staticmethod(get)
+    
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.requests = queue.Queue()
+    
+    def push(self, backup, data):
+        """ Request to add data to the backup. """
+        self.requests.put((backup, data))
+    
+    def wait(self):
+        """ Wait all requests to be processed. """
+        self.requests.join()
+    
+    def run(self):
+        while True:
+            backup, data = self.requests.get()
+            try:
+                backup.add(data)
+            except Exception as e:
+                print(e)
+                traceback.print_exc()
+            finally:
+                self.requests.task_done()
@@ -11,10 +11,40 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import bisect
+import itertools
+
+from bookmarks.cmdparse import bk_command_parsed
+
+_tag_names = {}
+_tag_tuples = {}
+
+_generations = itertools.count(1)
+
+def next_generation():
+    """ Returns new generation number which increases monotonically. """
+    return next(_generations)
+
+def intern_tags(names):
+    """ Returns shared tuple of tag names, empty names are removed. """
+    if not names:
+        return ()
+    key = tuple(names)
+    tags = _tag_tuples.get(key, None)
+    if tags is None:
+        tags = tuple([_tag_names.setdefault(name, name) 
+                        for name in names if name])
+        tags = _tag_tuples.setdefault(tags, tags)
+        # names containing empty name are mapped to the filtered one
+        _tag_tuples[key] = tags
+    return tags
 
 
 class BookmarksDefs(object):
     """ Definition of bookmarks attributes. """
+    
+    __slots__ = ()
+    
     NAME_ID = "id"
     NAME_TYPE = "type"
     NAME_PARENT = "parent"
@@ -31,6 +61,8 @@ class BookmarksDefs(object):
 
 class TypedItem(object):
     
+    __slots__ = ()
+    
     def is_separator(self):
         """ Check item is separator. """
         return False
@@ -57,10 +89,49 @@ class TagManager(TypedItem):
     def __init__(self):
         self.tags = {}
         self.name = self.TAGS_DEFALUT_NAME
+        self._sorted_names = None
+        self._sorted_tags = None
+        self.generation = self.tree_generation = next_generation()
+        self.pending = False # tag members are not yet added
     
     def set_name(self, name):
         self.name = name
     
+    def get_generation(self):
+        """ Returns generation of the list of tags. """
+        return self.generation
+    
+    def get_tree_generation(self):
+        """ Returns generation updated by changes of any tags too. """
+        return self.tree_generation
+    
+    def touch(self):
+        """ Mark the list of tags as changed. """
+        self.generation = self.tree_generation = next_generation()
+    
+    def get_owner(self):
+        return None
+    
+    def load_pending(self):
+        """ Add pending items to their tags. """
+        self.pending = False
+    
+    def touch_item(self, item):
+        """ Mark containers showing the item as changed, this should 
+            be called after values of the item are changed. """
+        if item.is_tag():
+            item.touch()
+            return
+        container = item.get_container()
+        if not container is None:
+            container.touch()
+        if item.is_item():
+            tags = self.tags
+            for name in item.get_tags():
+                tag = tags.get(name, None)
+                if tag:
+                    tag.touch()
+    
     def get_name(self):
         return self.name
     
@@ -70,13 +141,58 @@ class TagManager(TypedItem):
     def is_tag_container(self):
         return True
     
+    def _get_sorted_names(self):
+        """ Returns sorted tag names, which is kept until tags are 
+            added or removed. """
+        if self._sorted_names is None:
+            names = list(self.tags.keys())
+            names.sort()
+            self._sorted_names = names
+        return self._sorted_names
+    
+    def _set_tag(self, name, tag):
+        if not self._sorted_names is None and not name in self.tags:
+            bisect.insort(self._sorted_names, name)
+        self._sorted_tags = None
+        self.tags[name] = tag
+        tag.owner = self
+        self.touch()
+    
+    def _pop_tag(self, name):
+        if self.pending:
+            self.load_pending()
+        tag = self.tags.pop(name, None)
+        if tag and not self._sorted_names is None:
+            names = self._sorted_names
+            index = bisect.bisect_left(names, name)
+            if index < len(names) and names[index] == name:
+                del names[index]
+        self._sorted_tags = None
+        if tag:
+            self.touch()
+        return tag
+    
     def get_children(self):
-        tags = [(name, tag) for name, tag in self.tags.items()]
-        tags.sort()
-        return [item[1] for item in tags]
+        """ Returns tags sorted by their name. Do not modify it. """
+        if self._sorted_tags is None:
+            tags = self.tags
+            self._sorted_tags = [tags[name] 
+                                    for name in self._get_sorted_names()]
+        return self._sorted_tags
+    
+    def get_child_count(self):
+        return len(self.tags)
     
     def get_child_at(self, index):
-        return self.get_children()[index]
+        return self.tags[self._get_sorted_names()[index]]
+    
+    def get_child_index(self, tag):
+        names = self._get_sorted_names()
+        name = tag.get_name()
+        index = bisect.bisect_left(names, name)
+        if index < len(names) and names[index] == name:
+            return index
+        return -1
     
     def get_tag_names(self):
         return list(self.tags.keys())
@@ -94,36 +210,69 @@ class TagManager(TypedItem):
         return name in self.tags
     
     def rename_tag(self, old_name, new_name):
-        tag = self.tags.pop(old_name, None)
+        tag = self._pop_tag(old_name)
         tag.set_name(new_name)
-        self.tags[new_name] = tag
+        self._set_tag(new_name, tag)
+        for child in tag.get_children():
+            self.touch_item(child)
     
     def add_tag_group(self, name, description=""):
         if name:
             tag = self.get_tag(name)
             if not tag:
                 tag = TagContainer(name, description)
-                self.tags[name] = tag
+                self._set_tag(name, tag)
             return tag
     
     def add_tag_container(self, tag):
-        self.tags[tag.get_name()] = tag
+        self._set_tag(tag.get_name(), tag)
     
     def remove_tag(self, name):
-        tag = self.tags.pop(name, None)
+        tag = self._pop_tag(name)
         if tag:
             for child in tag.get_children():
                 child.remove_tag(name)
+                self.touch_item(child)
     
     def update_tags(self, item, add=True):
         if item.is_item():
             self.check_tag(item, add)
         elif item.is_container():
-            for child in item.get_children():
-                if child.is_item():
-                    self.check_tag(child, add)
-                elif child.is_container():
-                    self.update_tags(child)
+            self.update_tags_of(item.get_children(), add)
+    
+    def update_tags_of(self, items, add=True):
+        """ Add or remove items and items in containers to their tags. 
+            Items are grouped by tag, each tag is looked up once. """
+        tagged = {}
+        self._collect_tagged(items, tagged)
+        self.update_tagged(tagged, add)
+    
+    def update_tagged(self, tagged, add=True):
+        """ Add or remove items to tags, tagged is dict of tag name 
+            and list of items. """
+        for name, _items in tagged.items():
+            tag = self.get_tag(name)
+            if add:
+                if not tag:
+                    tag = self.add_tag_group(name)
+                for item in _items:
+                    tag.append_child(item)
+            elif tag:
+                for item in _items:
+                    tag.remove_child(item)
+                if not tag.get_child_count():
+                    self.remove_tag(name)
+    
+    def _collect_tagged(self, items, tagged):
+        for item in items:
+            if item.is_item():
+                for name in item.get_tags():
+                    try:
+                        tagged[name].append(item)
+                    except KeyError:
+                        tagged[name] = [item]
+            elif item.is_container():
+                self._collect_tagged(item.get_children(), tagged)
     
     def check_tag(self, item, add=True):
         for name in item.get_tags():
@@ -144,19 +293,28 @@ class TagManager(TypedItem):
                 if not tag.remove_child(item):
                     self.remove_tag(name)
     
-    def check_tag_containers(self):
-        """ Find empty container and remove them, returns removed. """
+    def check_tag_containers(self, names=None, items=None):
+        """ Find empty container and remove them, returns removed. 
+            Only tags specified by names are checked for items if given. 
+        """
         removed = []
-        for tag in self.tags.values():
-            if not tag.check_children():
+        if names is None:
+            tags = list(self.tags.values())
+        else:
+            tags = [self.tags[name] for name in names if name in self.tags]
+        for tag in tags:
+            if not tag.check_children(items):
                 removed.append(tag)
         for tag in removed:
-            self.tags.pop(tag.get_name())
+            self._pop_tag(tag.get_name())
         return removed
 
 
 class DescriptiveItem(object):
     """ Item having name and description. """
+    
+    __slots__ = ()
+    
     def __init__(self, name="", description=""):
         self.name = name
         self.description = description
@@ -189,12 +347,44 @@ class DescriptiveItem(object):
 
 class BaseContainer(TypedItem):
     
+    __slots__ = ()
+    
     def __init__(self):
         self.children = []
+        self._positions = None
+        self._scanned = False
+        self.generation = self.tree_generation = next_generation()
     
     def is_container(self):
         return True
     
+    def get_generation(self):
+        """ Returns generation of this container, which is updated 
+            when children or values of them are changed. """
+        return self.generation
+    
+    def get_tree_generation(self):
+        """ Returns generation updated by changes in the subtree too. """
+        return self.tree_generation
+    
+    def is_modified_since(self, generation):
+        """ Check the subtree has been changed after the generation. """
+        return generation < self.tree_generation
+    
+    def touch(self):
+        """ Mark this container as changed, ancestors are marked 
+            as their subtree is changed. """
+        generation = next_generation()
+        self.generation = generation
+        container = self
+        while not container is None:
+            container.tree_generation = generation
+            container = container.get_owner()
+    
+    def get_owner(self):
+        """ Returns container which contains this container. """
+        return None
+    
     def get_children(self):
         return self.children
     
@@ -208,20 +398,103 @@ class BaseContainer(TypedItem):
         return None
     
     def get_child_index(self, item):
-        try:
-            return self.children.index(item)
-        except:
-            return -1
+        """ Returns position of the child, -1 if not found. """
+        children = self.children
+        positions = self._positions
+        if not positions is None and self._indexed is children:
+            position = positions.get(item, None)
+            if not position is None and position < self._indexed_to:
+                if position < len(children) and children[position] is item:
+                    return position
+                # index has been lost by direct changes of the children
+                self._invalidate_index()
+            elif not self._scanned:
+                # the first lookup after a change scans changed children, 
+                # the map is updated if requested again before next change
+                self._scanned = True
+                try:
+                    return children.index(item, self._indexed_to)
+                except ValueError:
+                    return -1
+        self._update_index()
+        position = self._positions.get(item, None)
+        if not position is None and position < len(children) and \
+                children[position] is item:
+            return position
+        return -1
+    
+    def _invalidate_index(self, position=0):
+        """ Invalidate positions of children after position. """
+        self._scanned = False
+        if not self._positions is None and position < self._indexed_to:
+            self._indexed_to = position
+            del self._ranks[position:]
+    
+    def _update_index(self):
+        """ Update item to position map of children. The map is 
+            constructed when requested and only entries after the 
+            changed position are updated. Lookups between changes are 
+            dict lookups. The first lookup after a change at position p 
+            scans children after p by list.index, the map is updated 
+            from p by the next lookup. A lookup after each change in 
+            the middle takes O(n - p), see tools/bench_index.py. """
+        children = self.children
+        if self._positions is None or not self._indexed is children:
+            # children has been replaced
+            self._indexed = children
+            self._indexed_to = 0
+            self._positions = {}
+            self._ranks = []
+        n = self._indexed_to
+        if n < len(children):
+            self._positions.update(
+                zip(children[n:], range(n, len(children))))
+            self._indexed_to = len(children)
+    
+    def _update_ranks(self):
+        """ Update numbers of child containers before each child 
+            in the indexed children. """
+        children = self.children
+        ranks = self._ranks
+        n = len(ranks)
+        if n < self._indexed_to:
+            if n:
+                rank = ranks[n - 1]
+                if children[n - 1].is_container():
+                    rank += 1
+            else:
+                rank = 0
+            for position in range(n, self._indexed_to):
+                ranks.append(rank)
+                if children[position].is_container():
+                    rank += 1
+    
+    def _forget_index(self, item):
+        """ Remove item from the position map. """
+        if not self._positions is None:
+            self._positions.pop(item, None)
 
 
 class TagContainer(BaseContainer, DescriptiveItem):
+    """ Keeps tagged items in order of addition. 
+    
+        Membership of items is kept in the dict with serial numbers. 
+        Removed items are left in the children until the children 
+        are requested. 
+    """
     
     def __init__(self, name, description=""):
         BaseContainer.__init__(self)
         DescriptiveItem.__init__(self, name, description)
+        self._members = {} # item: serial
+        self._serials = [] # serials of children
+        self._serial = 0
+        self._removed = 0
+        self.owner = None # tag manager
     
     def create(o):
-        return TagContainer(o["name"], o["description"])
+        return TagContainer(o[BookmarksDefs.NAME_NAME], 
+            o.get(BookmarksDefs.NAME_DESCRIPTION, ""))
     
     create = staticmethod(create)
     
@@ -234,36 +507,90 @@ class TagContainer(BaseContainer, DescriptiveItem):
     def is_container(self):
         return False
     
+    def get_owner(self):
+        return self.owner
+    
     def set_name(self, name):
         _name = self.name
         self.name = name
         # update tag name
-        for item in self.children:
-            tags = item.get_tags()
-            try:
-                tags[tags.index(_name)] = name
-            except:
-                pass
+        for item in self.get_children():
+            item.replace_tag(_name, name)
+        self.touch()
+    
+    def _load_pending(self):
+        """ Items are added by the tag manager before the first access 
+            if they are lazily loaded. """
+        owner = self.owner
+        if not owner is None and owner.pending:
+            owner.load_pending()
+    
+    def _compact(self):
+        """ Remove entries of removed items from children. """
+        if self._removed:
+            members = self._members
+            children = []
+            serials = []
+            for child, serial in zip(self.children, self._serials):
+                if members.get(child, None) == serial:
+                    children.append(child)
+                    serials.append(serial)
+            self.children = children
+            self._serials = serials
+            self._removed = 0
+    
+    def get_children(self):
+        self._load_pending()
+        self._compact()
+        return self.children
+    
+    def get_child_count(self):
+        self._load_pending()
+        return len(self._members)
+    
+    def get_child_at(self, index):
+        self._load_pending()
+        self._compact()
+        return BaseContainer.get_child_at(self, index)
+    
+    def get_child_index(self, item):
+        self._load_pending()
+        if not item in self._members:
+            return -1
+        self._compact()
+        return BaseContainer.get_child_index(self, item)
+    
+    def has_child(self, item):
+        self._load_pending()
+        return item in self._members
     
     def append_child(self, item):
-        if not item in self.children:
+        self._load_pending()
+        if not item in self._members:
+            self._serial += 1
+            self._members[item] = self._serial
             self.children.append(item)
+            self._serials.append(self._serial)
+            self.touch()
     
     def remove_child(self, item):
-        if item in self.children:
-            self.children.remove(item)
-        return len(self.children)
-    
-    def check_children(self):
-        """ Check all children and remove child if it has not tag. """
-        removing = []
+        self._load_pending()
+        if item in self._members:
+            del self._members[item]
+            self._removed += 1
+            self.touch()
+        return len(self._members)
+    
+    def check_children(self, items=None):
+        """ Check children and remove child if it has not tag. 
+            Only items are checked if specified. """
         name = self.name
-        for child in self.children:
-            if not name in child.get_tags():
-                removing.append(child)
-        for child in removing:
-            self.remove_child(child)
-        return len(self.children)
+        if items is None:
+            items = self.get_children()
+        for child in items:
+            if child in self._members and not child.has_tag(name):
+                self.remove_child(child)
+        return len(self._members)
     
     def as_json(self):
         """ Returns JSON-able object. """
@@ -279,9 +606,15 @@ class BookmarksManagerBase(TagManager):
     def __init__(self):
         TagManager.__init__(self)
         self._id = 0
+        # ids up to this are kept for items loaded from the file, 
+        # they can be used by items not yet created
+        self.reserved_id = 0
+        # reserved ids of items unregistered, they are kept when the 
+        # items are inserted again, as the journal is replayed
+        self.released = set()
         self.base = None
         self.containers = {} # id: container
-        self._deepcopy = None
+        self.items = {} # id: item
     
     def next_id(self):
         """ Returns next identical number. """
@@ -292,28 +625,90 @@ class BookmarksManagerBase(TagManager):
         """ Set id to 0. """
         self._id = 0
     
+    def reserve_ids(self, id):
+        """ Reserve ids up to id for items loaded from the file. """
+        self.reserved_id = id
+        self.released.clear()
+    
     def get_root(self):
         """ Get root container. """
         return self.base
     
     def clear_containers(self):
-        """ Clear containers. """
+        """ Clear containers and registered items. """
         self.containers.clear()
+        self.items.clear()
+    
+    def get_item(self, id):
+        """ Get registered item by its id. """
+        item = self.items.get(id, None)
+        if item is None and self.pending:
+            # not yet loaded
+            self.load_pending()
+            item = self.items.get(id, None)
+        return item
+    
+    def has_free_id(self, item):
+        """ Check the item has id which is not used by other item. 
+            Reserved ids are free only for the item registered with. """
+        id = item.get_id()
+        if id is None:
+            return False
+        found = self.items.get(id, None)
+        if found is None:
+            return id > self.reserved_id or id in self.released
+        return found is item
+    
+    def assign_free_ids(self, container):
+        """ Assign new ids to children which do not have free id and 
+            register them. This is used for inserted containers. """
+        self.register_item(container)
+        parent_id = container.get_id()
+        for child in container.get_children():
+            if not self.has_free_id(child):
+                child.set_id(self.next_id())
+            child.set_parent(parent_id)
+            child.set_container(container)
+            self.register_item(child)
+            if child.is_container():
+                self.assign_free_ids(child)
     
     def get_parent_container(self, item):
         """ Get parent container of the item. """
-        return self.containers.get(item.get_parent(), None)
+        container = item.get_container()
+        if container is None:
+            container = self.containers.get(item.get_parent(), None)
+            if container is None and self.pending:
+                self.load_pending()
+                container = self.containers.get(item.get_parent(), None)
+        return container
     
     def duplicate_item(self, item):
-        """ Create copy of item. """
-        if not self._deepcopy:
-            import copy
-            self._deepcopy = copy.deepcopy
-        copied = self._deepcopy(item)
-        copied.set_parent(None)
+        """ Create copy of item. New ids are assigned to the copy and 
+            its children. The copy is registered when it is inserted. 
+        """
+        return self._copy_item(item, None)
+    
+    def _copy_item(self, item, container):
+        """ Copy bookmark values of the item and its children. """
+        if item.is_container():
+            copied = Container(item.name, item.description)
+        elif item.is_item():
+            copied = Item(item.name, item.description, item.command)
+            copied.tags = item.tags # shared tuple
+            copied.parsed = item.parsed
+            if item.options:
+                copied.options = dict(item.options)
+        else:
+            copied = Separator()
         copied.set_id(self.next_id())
-        if copied.is_container():
-            self.assign_id(copied)
+        if container:
+            copied.set_parent(container.get_id())
+            copied.set_container(container)
+        if item.is_container():
+            children = copied.children
+            for child in item.get_children():
+                children.append(self._copy_item(child, copied))
         return copied
     
     def assign_id(self, container):
@@ -324,6 +719,7 @@ class BookmarksManagerBase(TagManager):
         for child in container.get_children():
             child.set_id(self.next_id())
             child.set_parent(parent_id)
+            child.set_container(container)
             if child.is_container():
                 self.assign_id(child)
     
@@ -334,7 +730,61 @@ class BookmarksManagerBase(TagManager):
         base = self.base
         base.set_id(self.next_id())
         self.assign_id(base)
-        self.register_container(base, True)
+        self.register_item(base, True)
+    
+    def index_tree(self, container, tagged):
+        """ Assign new ids to children of the container and register 
+            them. Items are collected into tagged by tag name to be 
+            passed to update_tagged. This does assign_id, register_item 
+            and update_tags for the container in one pass. 
+        """
+        parent_id = container.id
+        items = self.items
+        containers = self.containers
+        next_id = self.next_id
+        for child in container.get_children():
+            id = next_id()
+            child.id = id
+            child.parent = parent_id
+            child.container = container
+            items[id] = child
+            if child.is_container():
+                containers[id] = child
+                self.index_tree(child, tagged)
+            elif child.is_item():
+                for name in child.tags:
+                    try:
+                        tagged[name].append(child)
+                    except KeyError:
+                        tagged[name] = [child]
+    
+    def register_item(self, item, recursive=False):
+        """ Register item to be found by its id. Containers are 
+            registered as container too. """
+        id = item.get_id()
+        if not id is None:
+            self.items[id] = item
+            if id > self._id:
+                # ids kept by the journal are not given again
+                self._id = id
+        if item.is_container():
+            self.register_container(item)
+            if recursive:
+                for child in item.get_children():
+                    self.register_item(child, True)
+    
+    def unregister_item(self, item, recursive=False):
+        """ Unregister item and its children if recursive. """
+        id = item.get_id()
+        if not id is None and self.items.get(id, None) is item:
+            self.items.pop(id)
+            if id <= self.reserved_id:
+                self.released.add(id)
+        if item.is_container():
+            self.unregister_container(item)
+            if recursive:
+                for child in item.get_children():
+                    self.unregister_item(child, True)
     
     def register_container(self, container, recursive=False):
         """ Register container which can be easily accessed. """
@@ -357,6 +807,22 @@ class BookmarksManagerBase(TagManager):
                 if child.is_container():
                     self.unregister_container(child, True)
     
+    def load_children(self, container, dicts):
+        """ Create children of lazily loaded container from dicts. 
+            Children of child containers are kept as dicts. """
+        create = BaseItem.create
+        children = []
+        for o in dicts:
+            try:
+                child = create(o, self)
+            except Exception as e:
+                print(e)
+                continue
+            child.set_container(container)
+            self.register_item(child)
+            children.append(child)
+        return children
+    
     def create_separator(self):
         return Separator()
     
@@ -367,39 +833,60 @@ class BookmarksManagerBase(TagManager):
         return Item(name, description, command)
 
 
+class ChildrenChange(object):
+    """ Children inserted into or removed from the container. """
+    
+    def __init__(self, container, positions, items, containers=()):
+        self.container = container
+        self.positions = positions
+        self.items = items
+        # (index in child containers, container) of the child containers
+        self.containers = containers
+    
+    def get_container_indexes(self):
+        return [index for index, item in self.containers]
+
+
 class BaseItem(BookmarksDefs, TypedItem):
     """ Individual bookmark item. """
     
     ITEM_TYPE = ""
     
+    __slots__ = ("id", "parent", "container")
+    
     def __init__(self, id=None, parent=None):
         self.id = id
         self.parent = parent
+        self.container = None
     
-    def create(o):
-        """ Create new instance from dict. """
+    def create(o, loader=None):
+        """ Create new instance from dict. If loader is specified, 
+            children of container are created by the loader when 
+            they are requested. """
         self = BaseItem
-        item = None
         type = o[self.NAME_TYPE]
         if type == self.TYPE_ITEM:
-            item = Item()
-            item.set_command(o.get(self.NAME_COMMAND, ""))
+            item = Item(o.get(self.NAME_NAME, ""), 
+                        o.get(self.NAME_DESCRIPTION, ""), 
+                        o.get(self.NAME_COMMAND, ""), 
+                        o.get(self.NAME_TAGS, ()))
         elif type == self.TYPE_SEPARATOR:
             item = Separator()
         elif type == self.TYPE_CONTAINER:
-            item = Container()
-            item.children = o.get(self.NAME_CHILDREN, [])#\
-            #   [child for child in o.get(self.NAME_CHILDREN, [])]
+            item = Container(o.get(self.NAME_NAME, ""), 
+                             o.get(self.NAME_DESCRIPTION, ""))
+            if loader is None:
+                item.children = o.get(self.NAME_CHILDREN, [])#\
+                #   [child for child in o.get(self.NAME_CHILDREN, [])]
+                for child in item.children:
+                    child.container = item
+            else:
+                item.set_pending_children(
+                    loader, o.get(self.NAME_CHILDREN, []))
         else:
             raise TypeError()
-        if type == self.TYPE_ITEM or \
-            type == self.TYPE_CONTAINER:
-            item.set_name(o.get(self.NAME_NAME, ""))
-            item.set_description(o.get(self.NAME_DESCRIPTION, ""))
-            item.tags = o.get(self.NAME_TAGS, [])
-        
-        item.set_id(o[self.NAME_ID])
-        item.set_parent(o[self.NAME_PARENT])
+        item.id = o[self.NAME_ID]
+        item.parent = o[self.NAME_PARENT]
         return item
     
     create = staticmethod(create)
@@ -424,6 +911,14 @@ class BaseItem(BookmarksDefs, TypedItem):
         """ Set parent id. """
         self.parent = id
     
+    def get_container(self):
+        """ Get parent container. """
+        return self.container
+    
+    def set_container(self, container):
+        """ Set parent container. """
+        self.container = container
+    
     def has_id(self):
         return not self.id is None
     
@@ -439,6 +934,8 @@ class Separator(BaseItem):
     """ Separator item. """
     ITEM_TYPE = BookmarksDefs.TYPE_SEPARATOR
     
+    __slots__ = ()
+    
     def __str__(self):
         return "<%s.%s: %s,%s at 0x%x>" % (
             self.__class__.__module__, 
@@ -461,12 +958,16 @@ class Item(BaseItem, DescriptiveItem):
     
     ITEM_TYPE = BookmarksDefs.TYPE_ITEM
     
-    def __init__(self, name="", description="", command="", tags=[]):
+    __slots__ = ("name", "description", "command", "tags", "options", 
+                "parsed")
+    
+    def __init__(self, name="", description="", command="", tags=()):
         BaseItem.__init__(self)
         DescriptiveItem.__init__(self, name, description)
         self.command = command
-        self.options = {}
-        self.tags = tags
+        self.parsed = None
+        self.options = None
+        self.tags = intern_tags(tags)
     
     def is_item(self):
         return True
@@ -475,25 +976,32 @@ class Item(BaseItem, DescriptiveItem):
         return name in self.tags
     
     def get_tags(self):
+        """ Returns tuple of tag names. """
         return self.tags
     
     def set_tags(self, names):
-        try:
-            while True:
-                names.remove("")
-        except:
-            pass
-        self.tags = names
+        self.tags = intern_tags(names)
     
     def add_tag(self, name):
-        if not name in self.tags:
-            self.tags.append(name)
+        if name and not name in self.tags:
+            self.tags = intern_tags(self.tags + (name,))
     
     def remove_tag(self, name):
-        try:
-            self.tags.remove(name)
-        except:
-            pass
+        if name in self.tags:
+            self.tags = intern_tags(
+                [tag for tag in self.tags if tag != name])
+    
+    def replace_tag(self, old_name, new_name):
+        if old_name in self.tags:
+            tags = list(self.tags)
+            tags[tags.index(old_name)] = new_name
+            self.tags = intern_tags(tags)
+    
+    def get_options(self):
+        """ Returns options, which is created when requested. """
+        if self.options is None:
+            self.options = {}
+        return self.options
     
     def get_command(self):
         """ Returns item command. """
@@ -502,14 +1010,20 @@ class Item(BaseItem, DescriptiveItem):
     def set_command(self, text):
         """ Set item commmand. """
         self.command = text
+        self.parsed = None
+    
+    def get_parsed_command(self):
+        """ Returns parsed command, which is parsed when requested. """
+        if self.parsed is None:
+            self.parsed = bk_command_parsed(self.command)
+        return self.parsed
     
     def get_command_only(self):
         """ Returns command without arguments. """
-        return self.command.split("?", 1)[0]
+        return self.get_parsed_command().main
     
     def has_arguments(self):
-        parts = self.command.split("?", 1)
-        return len(parts) == 2 and len(parts[1]) > 0
+        return self.get_parsed_command().has_arguments()
     
     def as_json(self):
         """ Returns JSON-able object. """
@@ -529,57 +1043,133 @@ class Container(BaseItem, DescriptiveItem, BaseContainer):
     
     ITEM_TYPE = BookmarksDefs.TYPE_CONTAINER
     
+    __slots__ = ("name", "description", "_children", "_pending", 
+        "_positions", "_indexed", "_indexed_to", "_ranks", "_scanned", 
+        "generation", "tree_generation")
+    
     def __init__(self, name="", description=""):
         BaseItem.__init__(self)
         DescriptiveItem.__init__(self, name, description)
-        self.children = []
+        BaseContainer.__init__(self)
+    
+    def _get_children(self):
+        if self._children is None:
+            loader, dicts = self._pending
+            self._pending = None
+            self._children = []
+            self._children = loader.load_children(self, dicts)
+        return self._children
+    
+    def _set_children(self, children):
+        self._pending = None
+        self._children = children
+    
+    children = property(_get_children, _set_children)
+    
+    def set_pending_children(self, loader, dicts):
+        """ Keep children as dicts until they are requested, 
+            loader.load_children(container, dicts) creates them. """
+        self._children = None
+        self._pending = (loader, dicts)
+    
+    def is_pending(self):
+        """ Check children have not been created yet. """
+        return self._children is None
+    
+    def get_pending_children(self):
+        """ Returns dicts of children not yet created, or None. """
+        if self._children is None:
+            return self._pending[1]
+        return None
+    
+    def get_owner(self):
+        return self.container
     
     def get_child_container_index(self, item):
+        """ Returns position of the child in child containers. """
         if item.is_container():
-            n = 0
-            for child in self.children:
-                if child == item:
-                    return n
-                if child.is_container():
-                    n += 1
+            index = self.get_child_index(item)
+            if 0 <= index:
+                self._update_index()
+                self._update_ranks()
+                return self._ranks[index]
         return -1
     
-    def get_child_by_id(self, id):
-        """ Find child by id. """
-        if self.id == id:
-            return self
-        for child in self.children:
-            if child.get_id() == id:
-                return child
-            if child.is_container():
-                found = child.get_child_by_id(id)
-                if found:
-                    return found
-        return None
-    
     def insert_child(self, manager, position, item):
         """ Insert item at potision of this container. """
-        if item.get_id() is None:
+        if not manager.has_free_id(item):
             # do not change item id if it has
             item.set_id(manager.next_id())
         item.set_parent(self.get_id())
+        item.set_container(self)
+        if item.is_container():
+            manager.assign_free_ids(item)
         if len(self.children) <= position:
             self.children.append(item)
         else:
+            self._invalidate_index(position)
             self.children.insert(position, item)
             #self.children[position] = item
-        # check the item is already inserted
-        if item.is_container():
-            manager.register_container(item)
+        manager.register_item(item, True)
         manager.update_tags(item)
+        self.touch()
         return self
     
-    def insert_children(self, manager, position, items):
-        """ Insert items starting at position. """
-        #parent_id = self.get_id()
-        for i, item in enumerate(items):
-            self.insert_child(manager, position + i, item)
-        return self
+    def insert_children(self, manager, position, items, update_tag=True):
+        """ Insert items starting at position, returns ChildrenChange. """
+        position = min(position, len(self.children))
+        items = list(items)
+        self._attach_children(manager, items)
+        self._invalidate_index(position)
+        self.children[position:position] = items
+        return self._children_inserted(manager, 
+            list(range(position, position + len(items))), items, update_tag)
+    
+    def insert_children_at(self, manager, positions, items, update_tag=True):
+        """ Insert items at each position, returns ChildrenChange. 
+            Positions are indexes after the insertion in ascending order. 
+        """
+        children = self.children
+        items = list(items)
+        if not items:
+            return ChildrenChange(self, [], [])
+        self._attach_children(manager, items)
+        start = min(positions[0], len(children))
+        tail = children[start:]
+        merged = []
+        n = 0
+        inserted_positions = []
+        for position, item in zip(positions, items):
+            while start + len(merged) < position and n < len(tail):
+                merged.append(tail[n])
+                n += 1
+            inserted_positions.append(start + len(merged))
+            merged.append(item)
+        merged.extend(tail[n:])
+        self._invalidate_index(start)
+        children[start:] = merged
+        return self._children_inserted(
+                    manager, inserted_positions, items, update_tag)
+    
+    def _attach_children(self, manager, items):
+        parent_id = self.get_id()
+        for item in items:
+            if not manager.has_free_id(item):
+                item.set_id(manager.next_id())
+            item.set_parent(parent_id)
+            item.set_container(self)
+            if item.is_container():
+                manager.assign_free_ids(item)
+    
+    def _children_inserted(self, manager, positions, items, update_tag):
+        for item in items:
+            manager.register_item(item, True)
+        if update_tag:
+            manager.update_tags_of(items)
+        self.touch()
+        return ChildrenChange(self, positions, items, 
+            [(self.get_child_container_index(item), item) 
+                for item in items if item.is_container()])
     
     def append_child(self, manager, item):
         """ Append item at last. """
@@ -588,37 +1178,66 @@ class Container(BaseItem, DescriptiveItem, BaseContainer):
     
     def remove_child(self, manager, item, update_tag=True):
         """ Remove item from this child container if found. """
-        self.children.remove(item)
-        if item.is_container():
-            manager.unregister_container(item, True)
-        if update_tag:
-            manager.update_tags(item, add=False)
-        return item
+        index = self.get_child_index(item)
+        if index < 0:
+            raise ValueError("Not a child of the container.")
+        return self._remove_child_at(manager, index, update_tag)
     
     def remove_child_at(self, manager, index, update_tag=True):
         """ Remove item at index. """
         item = self.get_child_at(index)
         if item:
-            self.remove_child(manager, item, update_tag)
+            self._remove_child_at(manager, index, update_tag)
         return item
     
-    def remove_children_at(self, manager, index, count):
-        """ Remove number of children from index. """
-        for i in range(count):
-            position = index + count - 1 - i
-            item = self.get_child_at(position)
-            if item:
-                self.remove_child(manager, item)
-            #if item:
-            #    self.children.pop(position)
-            #    if item.is_container():
-            #        manager.unregister_container(item, True)
+    def _remove_child_at(self, manager, index, update_tag):
+        self._invalidate_index(index)
+        item = self.children.pop(index)
+        self._forget_index(item)
+        item.set_container(None)
+        manager.unregister_item(item, True)
+        if update_tag:
+            manager.update_tags(item, add=False)
+        self.touch()
+        return item
+    
+    def remove_children_at(self, manager, index, count, update_tag=True):
+        """ Remove number of children from index, returns ChildrenChange. """
+        return self.remove_children(
+            manager, list(range(index, index + count)), update_tag)
+    
+    def remove_children(self, manager, positions, update_tag=True):
+        """ Remove children at positions, returns ChildrenChange. """
+        children = self.children
+        positions = [position for position in sorted(set(positions)) 
+                        if 0 <= position < len(children)]
+        items = [children[position] for position in positions]
+        change = ChildrenChange(self, positions, items, 
+            [(self.get_child_container_index(item), item) 
+                for item in items if item.is_container()])
+        if not positions:
+            return change
+        start = positions[0]
+        removing = set(positions)
+        self._invalidate_index(start)
+        children[start:] = [child 
+            for position, child in enumerate(children[start:], start) 
+                if not position in removing]
+        for item in items:
+            self._forget_index(item)
+            item.set_container(None)
+            manager.unregister_item(item, True)
+        if update_tag:
+            manager.update_tags_of(items, add=False)
+        self.touch()
+        return change
     
     def move_child(self, source_index, dest_index):
         """ Move child in the cihldren container. """
         if 0 <= source_index < len(self.children) and \
             0 <= dest_index < len(self.children) and \
             source_index != dest_index:
+            self._invalidate_index(min(source_index, dest_index))
             item = self.children[source_index]
             if source_index < dest_index:
                 dest_index += 1
@@ -626,25 +1245,33 @@ class Container(BaseItem, DescriptiveItem, BaseContainer):
             if source_index > dest_index:
                 source_index += 1
             self.children.pop(source_index)
+            self.touch()
     
     def swap_children(self, index_a, index_b):
         """ Swap item positions. """
         if 0 <= index_a < len(self.children) and \
             0 <= index_b < len(self.children):
+            self._invalidate_index(min(index_a, index_b))
             children = self.children
             item_a = children[index_a]
             item_b = children[index_b]
             children[index_a] = item_b
             children[index_b] = item_a
+            self.touch()
     
     def as_json(self):
         """ Returns JSON compatible object. """
+        if self._children is None:
+            # not yet loaded
+            children = self._pending[1]
+        else:
+            children = [child.as_json() for child in self._children]
         return {
             self.NAME_ID: self.id, 
             self.NAME_TYPE: self.TYPE_CONTAINER, 
             self.NAME_PARENT: self.parent, 
             self.NAME_NAME: self.name, 
             self.NAME_DESCRIPTION: self.description, 
-            self.NAME_CHILDREN: [child.as_json() for child in self.children]
+            self.NAME_CHILDREN: children
         }
 
@@ -23,15 +23,21 @@ from com.sun.star.beans import PropertyValue
 from bookmarks.tools import get_config, \
     get_module_name, get_popup_names
 import bookmarks.base
-from bookmarks import TAG_POPUP_IMPLE_NAME
+from bookmarks.bookmark import Container
+from bookmarks import TAG_POPUP_IMPLE_NAME, USAGE_POPUP_IMPLE_NAME
 
 
 class BookmarksPopupBase(unohelper.Base, 
     bookmarks.base.PopupMenuControllerBase, XMenuListener):
     
     OPEN_ALL_ID = -0xff
+    # ids of "More" entries are allocated below this
+    MORE_ID_BASE = -0x100
     
     POPUP_NAMES = None
+    # number of entries shown in a popup, the rest is shown in "More" 
+    PAGE_SIZE = None
+    DEFAULT_PAGE_SIZE = 100
     
     def __init__(self, ctx, args):
         self.ctx = ctx
@@ -41,18 +47,37 @@ class BookmarksPopupBase(unohelper.Base,
         self.sub_popups = {}
         if self.__class__.POPUP_NAMES is None:
             self.__class__.POPUP_NAMES = get_popup_names(self.ctx)
+        if self.__class__.PAGE_SIZE is None:
+            self.__class__.PAGE_SIZE = self.load_page_size()
         self.controllers = {}
         self.command = None
         self.frame = None
         self.menu = None
         self.last_checked = 0
+        self.menu_container = None
+        self.menu_open_all = True
+        # container or (container, start) of page: 
+        #     (popup, generation, entries)
+        self.filled = {}
+        self.pages = {} # id of "More" entry: (container, start)
         
         from bookmarks.resource import CurrentStringResource
         self.res = CurrentStringResource.get(ctx)
         self._label_open_all = self.res.get("Open ~All")
+        self._label_more = self.res.get("~More")
+    
+    def load_page_size(self):
+        """ Read page size from the configuration. """
+        from bookmarks import CONFIG_NODE_SETTINGS, NAME_MENU_PAGE_SIZE
+        from bookmarks.tools import get_config_value
+        try:
+            return get_config_value(
+                self.ctx, CONFIG_NODE_SETTINGS, NAME_MENU_PAGE_SIZE)
+        except:
+            return self.DEFAULT_PAGE_SIZE
     
     def update_last_checked(self):
-        """ Read last modified time from the manager. """
+        """ Read generation of the last modification from the manager. """
         if self.manager:
             self.last_checked = self.manager.get_last_modified()
     
@@ -91,22 +116,38 @@ class BookmarksPopupBase(unohelper.Base,
     def itemSelected(self, ev):
         command = ev.Source.getCommand(ev.MenuId)
         if command:
+            self.record_usage(ev.MenuId)
             self.execute_command(command)
         
         elif ev.MenuId == self.OPEN_ALL_ID:
+            from bookmarks.openall import OpenAllScheduler
+            # selected again while opening, remaining ones are cancelled
+            if OpenAllScheduler.cancel_running(self.frame):
+                return
             popup = ev.Source
+            tasks = []
             for pos in range(popup.getItemCount()):
                 command = popup.getCommand(popup.getItemId(pos))
                 # ignore popup
                 if command and not command in self.__class__.POPUP_NAMES:
-                    try:
-                        self.execute_command(command)
-                    except:
-                        pass
+                    self.record_usage(popup.getItemId(pos))
+                    tasks.append((self.commands.execute_command, command, 
+                        self.commands.is_external_command(command)))
+            OpenAllScheduler.start(self.ctx, self.frame, tasks, 
+                self._label_open_all.replace("~", ""))
     
     def itemHighlighted(self, ev):
         id = ev.MenuId
         try:
+            if id in self.pages:
+                popup = ev.Source.getPopupMenu(id)
+                if popup and not popup.getItemCount():
+                    container, start = self.pages[id]
+                    self.fill_popup(popup, container, 
+                        not container is self.menu_container or 
+                        self.menu_open_all, start)
+                    popup.addMenuListener(self)
+                return
             item = self.sub_popups[id]
             popup = ev.Source.getPopupMenu(id)
             if popup:
@@ -121,45 +162,185 @@ class BookmarksPopupBase(unohelper.Base,
         except:
             pass
     
-    def fill_popup(self, popup, container, open_all=True):
-        """ Fill popupmenu from container. """
+    # kinds of entries in popup
+    ENTRY_ITEM = "item"
+    ENTRY_CONTAINER = "container"
+    ENTRY_SEPARATOR = "separator"
+    ENTRY_OPEN_ALL = "open_all"
+    ENTRY_MORE = "more"
+    
+    def get_menu_entries(self):
+        """ Returns entries shared by controllers of the bookmarks. """
+        if self.manager is None:
+            return None
+        return MenuEntries.get(self.manager)
+    
+    def get_page_id(self, container, start):
+        """ Returns id of "More" entry for the page. """
+        return MenuEntries.get(self.manager).get_page_id(container, start)
+    
+    def get_entries(self, container, open_all=True, start=0):
+        """ Returns list of entries to be shown for the container. 
+            Each entry is tuple of key, item, name, command and 
+            description. Entries having the same key are updated in place. 
+            Entries after the page size are shown in "More" from start.
+            Entries are built once for each change of the container 
+            and they are shared by controllers of all frames.
+        """
+        menu_entries = self.get_menu_entries()
+        if menu_entries is None:
+            return self.build_entries(container, open_all, start)
+        return menu_entries.get_entries(self, container, open_all, start)
+    
+    def build_entries(self, container, open_all=True, start=0):
+        """ Build entries for the container. """
+        entries = []
         has_item = False
-        for position, child in enumerate(container.get_children()):
-            id = child.get_id()
+        children = container.get_children()
+        end = len(children)
+        page_size = self.__class__.PAGE_SIZE
+        if page_size and page_size > 0 and end - start > page_size:
+            end = start + page_size
+        for child in children[start:end]:
             if child.is_item():
                 command = child.get_command_only()
-                popup.insertItem(
-                    id, child.get_name(), 0, position)
-                popup.setCommand(id, child.get_command())
-                desc = child.get_description()
-                if desc:
-                    popup.setTipHelpText(id, desc)
-                
+                # command of sub popup is in the key, its controller 
+                # is created for the command
+                sub = None
                 if command in self.__class__.POPUP_NAMES and \
                    (command.startswith("mytools.frame") or \
                     not child.has_arguments()):
-                    sub_popup = self.create_sub_popup()
-                    popup.setPopupMenu(id, sub_popup)
-                    self.sub_popups[id] = child
+                    sub = child.get_command()
+                entries.append(((self.ENTRY_ITEM, child.get_id(), sub), 
+                    child, child.get_name(), child.get_command(), 
+                    child.get_description()))
                 has_item = True
-            
             elif child.is_container():
-                popup.insertItem(
-                    id, child.get_name(), 0, position)
-                desc = child.get_description()
-                if desc:
-                    popup.setTipHelpText(id, desc)
-                sub_popup = self.create_sub_popup()
-                popup.setPopupMenu(id, sub_popup)
-                self.sub_popups[id] = child
-            
+                entries.append(((self.ENTRY_CONTAINER, child.get_id()), 
+                    child, child.get_name(), None, child.get_description()))
             elif child.is_separator():
-                popup.insertSeparator(position)
-        
+                entries.append(((self.ENTRY_SEPARATOR,), 
+                    child, None, None, None))
+        if end < len(children):
+            entries.append(((self.ENTRY_MORE, self.get_page_id(container, end)), 
+                (container, end), self._label_more, None, None))
         if open_all and has_item:
-            n = popup.getItemCount()
-            popup.insertSeparator(n)
-            popup.insertItem(-0xff, self._label_open_all, 0, n+1)
+            entries.append(((self.ENTRY_SEPARATOR,), None, None, None, None))
+            entries.append(((self.ENTRY_OPEN_ALL,), 
+                None, self._label_open_all, None, None))
+        return entries
+    
+    def fill_popup(self, popup, container, open_all=True, start=0):
+        """ Fill popupmenu from container. """
+        entries = self.get_entries(container, open_all, start)
+        key = start and (container, start) or container
+        self.filled[key] = (popup, container.get_generation(), entries)
+        for position, entry in enumerate(entries):
+            self.insert_entry(popup, position, entry)
+    
+    def insert_entry(self, popup, position, entry):
+        """ Insert entry into the popup at the position. """
+        key, child, name, command, desc = entry
+        kind = key[0]
+        if kind == self.ENTRY_SEPARATOR:
+            popup.insertSeparator(position)
+        elif kind == self.ENTRY_OPEN_ALL:
+            popup.insertItem(self.OPEN_ALL_ID, name, 0, position)
+        elif kind == self.ENTRY_MORE:
+            id = key[1]
+            popup.insertItem(id, name, 0, position)
+            popup.setPopupMenu(id, self.create_sub_popup())
+            self.pages[id] = child
+        else:
+            id = key[1]
+            popup.insertItem(id, name, 0, position)
+            if kind == self.ENTRY_ITEM:
+                popup.setCommand(id, command)
+            if desc:
+                popup.setTipHelpText(id, desc)
+            if kind == self.ENTRY_CONTAINER or key[2]:
+                popup.setPopupMenu(id, self.create_sub_popup())
+                self.sub_popups[id] = child
+    
+    def update_entry(self, popup, old, new):
+        """ Update entry having the same key. """
+        key = new[0]
+        if len(key) < 2 or key[0] == self.ENTRY_MORE:
+            return
+        id = key[1]
+        if old[2] != new[2]:
+            popup.setItemText(id, new[2])
+        if old[3] != new[3]:
+            popup.setCommand(id, new[3])
+        if old[4] != new[4]:
+            popup.setTipHelpText(id, new[4])
+        if id in self.sub_popups:
+            self.sub_popups[id] = new[1]
+    
+    def remove_entries(self, popup, key, open_all=True):
+        """ Remove entries no longer shown from the popup of the 
+            container or its page, returns changes to be applied by 
+            add_entries. Removals of all popups have to be done before 
+            additions, an item can be moved between them. """
+        _popup, generation, old = self.filled[key]
+        container, start = self.split_key(key)
+        new = self.get_entries(container, open_all, start)
+        import difflib
+        matcher = difflib.SequenceMatcher(None, 
+            [entry[0] for entry in old], [entry[0] for entry in new], False)
+        opcodes = matcher.get_opcodes()
+        for tag, i1, i2, j1, j2 in reversed(opcodes):
+            if tag in ("delete", "replace"):
+                popup.removeItem(i1, i2 - i1)
+                for entry in old[i1:i2]:
+                    self.forget_entry(entry)
+        self.filled[key] = (popup, container.get_generation(), new)
+        return (popup, key, old, new, opcodes)
+    
+    def add_entries(self, changes):
+        """ Insert and update entries after remove_entries. """
+        popup, key, old, new, opcodes = changes
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag in ("insert", "replace"):
+                for j in range(j1, j2):
+                    self.insert_entry(popup, j, new[j])
+            elif tag == "equal":
+                for i, j in zip(range(i1, i2), range(j1, j2)):
+                    self.update_entry(popup, old[i], new[j])
+    
+    def forget_entry(self, entry):
+        """ Forget sub popup and controller of removed entry. """
+        key = entry[0]
+        if len(key) < 2:
+            return
+        id = key[1]
+        if key[0] == self.ENTRY_MORE:
+            page = self.pages.pop(id, None)
+            if page in self.filled:
+                self.forget_popup(page)
+            return
+        item = self.sub_popups.pop(id, None)
+        controller = self.controllers.pop(id, None)
+        if controller and hasattr(controller, "dispose"):
+            try:
+                controller.dispose()
+            except:
+                pass
+        if item and item.is_container() and item in self.filled:
+            self.forget_popup(item)
+    
+    def forget_popup(self, key):
+        """ Forget filled popup and its entries. """
+        popup, generation, entries = self.filled.pop(key)
+        popup.removeMenuListener(self)
+        for entry in entries:
+            self.forget_entry(entry)
+    
+    def split_key(self, key):
+        """ Returns container and start of the page for key of filled. """
+        if isinstance(key, tuple):
+            return key
+        return key, 0
     
     def prepare_menu(self, clear=False, open_all=True):
         """ Fill menu with entries. """
@@ -168,7 +349,11 @@ class BookmarksPopupBase(unohelper.Base,
                 self.menu.clear()
                 self.sub_popups.clear()
                 self.controllers.clear()
+                self.filled.clear()
+                self.pages.clear()
             container = self.get_container()
+            self.menu_container = container
+            self.menu_open_all = open_all
             if container:
                 self.fill_popup(self.menu, container, open_all)
             if not clear:
@@ -177,6 +362,35 @@ class BookmarksPopupBase(unohelper.Base,
             print(e)
         self.update_last_checked()
     
+    def update_menu(self, open_all=True):
+        """ Update entries filled from changed containers. 
+            Only changed entries are removed, inserted or updated, 
+            sub popups of untouched entries are kept filled. 
+        """
+        container = self.get_container()
+        if container is None or not container is self.menu_container or \
+                not container in self.filled:
+            self.prepare_menu(clear=True, open_all=open_all)
+            return
+        try:
+            changes = []
+            for key, (popup, generation, entries) in \
+                    list(self.filled.items()):
+                _container = self.split_key(key)[0]
+                # removed with its parent
+                if key in self.filled and \
+                        generation != _container.get_generation():
+                    changes.append(self.remove_entries(popup, key, 
+                        open_all or not _container is container))
+            for change in changes:
+                if change[1] in self.filled:
+                    self.add_entries(change)
+        except Exception as e:
+            print(e)
+            self.prepare_menu(clear=True, open_all=open_all)
+            return
+        self.update_last_checked()
+    
     def get_container(self):
         pass
     
@@ -194,7 +408,7 @@ class BookmarksPopupBase(unohelper.Base,
                 )
                 controller = self.ctx.getServiceManager().\
                     createInstanceWithArgumentsAndContext(name, tuple(args), self.ctx)
-                if name == TAG_POPUP_IMPLE_NAME:
+                if name in (TAG_POPUP_IMPLE_NAME, USAGE_POPUP_IMPLE_NAME):
                     controller.set_controller(self)
                 controller.setPopupMenu(popup)
                 self.controllers[item.get_id()] = controller
@@ -202,6 +416,13 @@ class BookmarksPopupBase(unohelper.Base,
         except Exception as e:
             print(e)
     
+    def record_usage(self, id):
+        """ Count execution of the item shown as the entry. """
+        if id > 0 and self.manager and self.commands:
+            item = self.manager.get_item(id)
+            if item is not None and item.is_item():
+                self.commands.record_usage(item)
+    
     def message(self, message, title, error=False):
         """ Shows message. """
         from bookmarks.tools import show_message
@@ -223,6 +444,99 @@ class BookmarksPopupBase(unohelper.Base,
             self.message(str(e), "Error")
 
 
+class MenuEntries(object):
+    """ Entries of popup menus built from containers of a bookmarks. 
+        Entries are kept with the generation of the container and they 
+        are rebuilt after the container is changed. Entries and ids of 
+        "More" entries of containers removed from the bookmarks are 
+        dropped after the bookmarks is changed. 
+    """
+    
+    Entries = {} # manager: MenuEntries
+    
+    def get(manager):
+        """ Returns entries for the manager. """
+        klass = MenuEntries
+        entries = klass.Entries.get(manager, None)
+        if entries is None:
+            entries = klass(manager)
+            klass.Entries[manager] = entries
+        return entries
+    
+    get = staticmethod(get)
+    
+    def release(manager):
+        """ Forget entries of the manager. """
+        MenuEntries.Entries.pop(manager, None)
+    
+    release = staticmethod(release)
+    
+    def __init__(self, manager):
+        self.manager = manager
+        self.entries = {} # (container, start, open_all): (generation, entries)
+        self.page_ids = {} # (container, start): id of "More" entry
+        self.free_ids = [] # ids of "More" entries of removed pages
+        self.next_page_id = BookmarksPopupBase.MORE_ID_BASE
+        self.pruned = 0 # generation of the bookmarks when pruned
+        self.builds = 0
+        self.hits = 0
+    
+    def get_page_id(self, container, start):
+        """ Returns id of "More" entry for the page. Ids are shared, 
+            they are unique in the bookmarks. """
+        page = (container, start)
+        id = self.page_ids.get(page, None)
+        if id is None:
+            if self.free_ids:
+                id = self.free_ids.pop()
+            else:
+                id = self.next_page_id
+                self.next_page_id -= 1
+            self.page_ids[page] = id
+        return id
+    
+    def get_entries(self, controller, container, open_all, start):
+        """ Returns entries of the container built by the controller 
+            if they are not built after the last change. """
+        key = (container, start, not not open_all)
+        generation = container.get_generation()
+        found = self.entries.get(key, None)
+        if found and found[0] == generation:
+            self.hits += 1
+            return found[1]
+        if self.manager.is_modified_since(self.pruned):
+            self.prune()
+        entries = controller.build_entries(container, open_all, start)
+        self.entries[key] = (generation, entries)
+        self.builds += 1
+        return entries
+    
+    def is_shown(self, container, start=0):
+        """ Check the container is in the bookmarks and the page 
+            starting from start is there. """
+        manager = self.manager
+        if container.is_tag():
+            if manager.tags.get(container.get_name(), None) is not container:
+                return False
+        elif isinstance(container, Container):
+            if manager.containers.get(container.get_id(), None) is not container:
+                return False
+        return not start or start < container.get_child_count()
+    
+    def prune(self):
+        """ Drop entries and ids of pages no longer in the bookmarks. 
+            Popups showing them are removed by the next update of 
+            their controllers, before new entries are inserted. """
+        self.pruned = self.manager.get_last_modified()
+        is_shown = self.is_shown
+        for key in [key for key in self.entries 
+                        if not is_shown(key[0], key[1])]:
+            self.entries.pop(key)
+        for page in [page for page in self.page_ids 
+                        if not is_shown(page[0], page[1])]:
+            self.free_ids.append(self.page_ids.pop(page))
+
+
 class BookmarksPopup(BookmarksPopupBase):
     """ Pop-up controller for bookmarks menu. """
     
@@ -244,6 +558,8 @@ class BookmarksPopup(BookmarksPopupBase):
                     v.dispose()
             except:
                 pass
+        from bookmarks.usage import BookmarksUsage
+        BookmarksUsage.flush_all()
     
     def init(self):
         import bookmarks.manager
@@ -278,7 +594,7 @@ class BookmarksPopup(BookmarksPopupBase):
     
     def updatePopupMenu(self):
         if self.manager.is_modified_since(self.last_checked):
-            self.prepare_menu(clear=True, open_all=False)
+            self.update_menu(open_all=False)
         if not self.has_location:
             self.has_location = self.check_has_location()
 
@@ -104,3 +104,47 @@ def bk_command_parse(command):
     
     return main, scheme, path, query
 
+
+
+class ParsedCommand(object):
+    """ Parsed command, which is shared between items having the 
+    same command. Do not modify its values. 
+    """
+    
+    __slots__ = ("command", "main", "protocol", "path", "query", "qs", 
+                "extracted")
+    
+    def __init__(self, command):
+        self.command = command
+        self.main, self.protocol, self.path, self.query = \
+                                            bk_command_parse(command)
+        if self.query:
+            self.qs = bk_parse_qs(self.query, self.main)
+        else:
+            self.qs = {}
+        # type and values detected by BookmarksCommands
+        self.extracted = None
+    
+    def get_command_only(self):
+        """ Returns command without arguments. """
+        return self.main
+    
+    def has_arguments(self):
+        return len(self.query) > 0
+
+
+_parsed_commands = {}
+PARSED_COMMANDS_SIZE = 0x4000
+
+def bk_command_parsed(command):
+    """ Returns parsed command which is shared for the same command. """
+    try:
+        return _parsed_commands[command]
+    except KeyError:
+        pass
+    if len(_parsed_commands) >= PARSED_COMMANDS_SIZE:
+        # items keep their own reference
+        _parsed_commands.clear()
+    parsed = ParsedCommand(command)
+    _parsed_commands[command] = parsed
+    return parsed
@@ -16,7 +16,8 @@ import traceback
 import uno
 
 from bookmarks.cmdparse import \
-    bk_urlencode, bk_parse_qsl, bk_parse_qs, bk_command_parse
+    bk_urlencode, bk_parse_qsl, bk_parse_qs, bk_command_parse, \
+    bk_command_parsed
 
 
 from bookmarks import \
@@ -33,7 +34,7 @@ def load_controller_name(ctx, command):
 class BookmarksCommands(object):
     
     from bookmarks import PROTOCOL_BOOKMARKS, DIRECTORY_POPUP_URI, \
-        TAG_POPUP_URI
+        TAG_POPUP_URI, USAGE_POPUP_URI
     
     PROTOCOL_SCRIPT = "vnd.sun.star.script:"
     PROTOCOL_MACRO = "macro:"
@@ -98,6 +99,16 @@ class BookmarksCommands(object):
     
     def extract_from_command(self, command):
         """ Extract data from command and detect command type. """
+        return self.extract_from_parsed(bk_command_parsed(command))
+    
+    def extract_from_parsed(self, parsed):
+        """ Extract data from parsed command, the result is kept 
+            in the parsed command. """
+        if parsed.extracted is None:
+            parsed.extracted = self._extract_from_parsed(parsed)
+        return parsed.extracted
+    
+    def _extract_from_parsed(self, parsed):
         def get_qs(name):
             try:
                 return qs[name]
@@ -107,9 +118,12 @@ class BookmarksCommands(object):
         item_type = ""
         value1 = ""
         value2 = ""
-        main, protocol, path, query = self.bk_command_parse(command)
-        qs = self.bk_parse_qs(query, main)
-        protocol = protocol + ":"
+        command = parsed.command
+        main = parsed.main
+        path = parsed.path
+        query = parsed.query
+        qs = parsed.qs
+        protocol = parsed.protocol + ":"
         
         if protocol == self.PROTOCOL_COMMAND:
             if command.startswith(self.COMMAND_OPEN_DOCUMENT) and \
@@ -162,7 +176,8 @@ class BookmarksCommands(object):
     
     def extract(self, item):
         """ Extract values from item. """
-        item_type, value1, value2 = self.extract_from_command(item.get_command())
+        item_type, value1, value2 = self.extract_from_parsed(
+                                            item.get_parsed_command())
         return (item_type, (item.get_name(), item.get_description(), 
                 value1, value2, ",".join(item.get_tags())))
     
@@ -176,14 +191,16 @@ class BookmarksCommands(object):
                 return qs[name]
             except:
                 return ""
-        command = item.get_command()
+        parsed = item.get_parsed_command()
+        command = parsed.command
         value = ""
         args = ""
         icon = None
         
-        main, protocol, path, query = self.bk_command_parse(command)
-        qs = self.bk_parse_qs(query, main)
-        protocol = protocol + ":"
+        main = parsed.main
+        path = parsed.path
+        qs = parsed.qs
+        protocol = parsed.protocol + ":"
         
         if protocol == self.PROTOCOL_COMMAND:
             if qs and main.startswith(self.COMMAND_OPEN_FROM) and \
@@ -579,10 +596,34 @@ class BookmarksCommandExecutor(DispatchExecutor):
             type = "other"
         return type
     
+    def is_external_command(self, command):
+        """ Check the command starts external program, it can be 
+            executed in another thread. """
+        if not command.startswith(self.PROTOCOL_BOOKMARKS):
+            return False
+        try:
+            return self.extract_from_command(command)[0] in (
+                self.TYPE_PROGRAM, self.TYPE_FILE, 
+                self.TYPE_FOLDER, self.TYPE_WEB)
+        except:
+            return False
+    
     def execute_item(self, item):
         """ Execute command on dispatch framework of the frame. """
+        self.record_usage(item)
         self.execute_command(item.get_command())
     
+    def record_usage(self, item):
+        """ Count execution of the item in the usage of the bookmarks. """
+        manager = getattr(self.parent, "manager", None)
+        if manager is None:
+            return
+        try:
+            from bookmarks.usage import BookmarksUsage
+            BookmarksUsage.get(manager).record(item)
+        except Exception as e:
+            print(e)
+    
     def execute_command(self, command):
         """ Exec command. """
         if command.startswith(self.PROTOCOL_BOOKMARKS):
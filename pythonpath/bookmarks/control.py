@@ -84,6 +84,9 @@ class TreeWindow(object):
     
     def tree_insert_node(self, parent, position, node):
         parent.insert_child(position, node)
+    
+    def tree_insert_nodes(self, parent, position, nodes):
+        parent.insert_children(position, nodes)
 
 
 class ExtendedTreeWindow(TreeWindow):
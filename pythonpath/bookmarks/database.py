@@ -0,0 +1,300 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from bookmarks.bookmark import BookmarksDefs, \
+    Item, Separator, Container, TagContainer, next_generation
+
+
+class BookmarksDatabase(object):
+    """ Keeps bookmarks in SQLite database.
+    
+        Each row of items keeps an item with its parent id and its
+        position in the parent. Children of containers changed after 
+        the last synchronization are checked, only rows of items moved 
+        or changed by values are written. Changes are taken in the 
+        main thread and they can be written in another thread.
+    """
+    
+    EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+    
+    SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    name TEXT,
+    command TEXT,
+    description TEXT,
+    tags TEXT
+);
+CREATE INDEX IF NOT EXISTS items_parent ON items (parent, position);
+CREATE TABLE IF NOT EXISTS tags (
+    name TEXT PRIMARY KEY,
+    description TEXT
+);
+"""
+    
+    INSERT_ITEM = "INSERT OR REPLACE INTO items " \
+        "(id, parent, position, type, name, command, description, tags) " \
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    
+    SELECT_SUBTREE = "WITH RECURSIVE subtree(id) AS (" \
+        "SELECT ? UNION ALL " \
+        "SELECT items.id FROM items, subtree " \
+        "WHERE items.parent = subtree.id) " \
+        "SELECT id FROM subtree"
+    
+    def is_database_url(file_url):
+        """ Check the file is kept in database. """
+        if not file_url or not file_url.startswith("file:"):
+            return False
+        name = file_url.lower()
+        for ext in BookmarksDatabase.EXTENSIONS:
+            if name.endswith(ext):
+                return True
+        return False
+    
+    is_database_url = staticmethod(is_database_url)
+    
+    def create(file_url):
+        """ Returns database for the file, None if the file is not
+            database or sqlite3 module is not available. """
+        if sqlite3 is None or \
+            not BookmarksDatabase.is_database_url(file_url):
+            return None
+        import uno
+        return BookmarksDatabase(uno.fileUrlToSystemPath(file_url))
+    
+    create = staticmethod(create)
+    
+    def __init__(self, path):
+        self.path = path
+        # generation of the last synchronization, None to write all
+        self.generation = None
+        self.positions = {} # id: (parent, position) of stored rows
+        self.dirty = set() # items changed by their values
+    
+    def _connect(self):
+        con = sqlite3.connect(self.path)
+        con.executescript(self.SCHEMA)
+        return con
+    
+    def set_synchronized(self):
+        """ Mark current bookmarks as stored. """
+        self.generation = next_generation()
+    
+    def mark_dirty(self, item):
+        """ Mark the item to be written, its values have been changed. """
+        self.dirty.add(item)
+    
+    def load(self):
+        """ Load bookmarks, returns tuple of tags, base and unsorted 
+            or None if no bookmarks are stored. """
+        con = self._connect()
+        try:
+            rows = con.execute(
+                "SELECT id, parent, position, type, name, command, "
+                "description, tags FROM items ORDER BY parent, position"
+                ).fetchall()
+            tag_rows = con.execute(
+                "SELECT name, description FROM tags").fetchall()
+        finally:
+            con.close()
+    
+        TYPE_ITEM = BookmarksDefs.TYPE_ITEM
+        TYPE_CONTAINER = BookmarksDefs.TYPE_CONTAINER
+        TYPE_SEPARATOR = BookmarksDefs.TYPE_SEPARATOR
+        items = {}
+        children = {} # parent id: list of children
+        positions = {}
+        for id, parent, position, type, name, command, description, tags \
+                in rows:
+            if type == TYPE_ITEM:
+                item = Item(name or "", description or "", command or "",
+                            tags and json.loads(tags) or ())
+            elif type == TYPE_CONTAINER:
+                item = Container(name or "", description or "")
+            elif type == TYPE_SEPARATOR:
+                item = Separator()
+            else:
+                continue
+            item.id = id
+            item.parent = parent
+            items[id] = item
+            positions[id] = (parent, position)
+            try:
+                children[parent].append(item)
+            except KeyError:
+                children[parent] = [item]
+    
+        for id, item in items.items():
+            if item.is_container():
+                _children = children.get(id, None)
+                if _children:
+                    item.children = _children
+                    for child in _children:
+                        child.container = item
+    
+        # roots are base and unsorted in this order
+        roots = [root for root in children.get(None, ()) 
+                    if root.is_container()]
+        if not roots:
+            return None
+        self.positions = positions
+        self.dirty = set()
+        tags = dict([(name, TagContainer(name, description or "")) 
+                        for name, description in tag_rows])
+        return tags, roots[0], len(roots) > 1 and roots[1] or None
+    
+    def store(self, manager):
+        """ Write changes after the last synchronization. """
+        self.write(self.take_changes(manager))
+    
+    def take_changes(self, manager):
+        """ Returns changes after the last synchronization to be written 
+            by write. This should be called from the main thread. """
+        generation = self.generation
+        changes = DatabaseChanges(generation is None)
+        roots = (manager.base, manager.unsorted)
+        changed = []
+        for root in roots:
+            self._find_changed(root, generation, changed)
+        dirty = self.dirty
+        self.dirty = set()
+        # root containers are always written, they are not
+        # marked as changed by their values
+        for position, root in enumerate(roots):
+            changes.add_row(self._row(root, None, position))
+        self._take_containers(changes, changed, dirty)
+        if changes.full or generation < manager.get_tree_generation():
+            changes.tags = [(tag.get_name(), tag.get_description())
+                                for tag in manager.tags.values()]
+        changes.generation = next_generation()
+        return changes
+    
+    def write(self, changes):
+        """ Write changes taken by take_changes. Changes after the 
+            last synchronization are written again if failed. """
+        try:
+            removed = self._write(changes)
+        except:
+            self.generation = None
+            raise
+        if changes.full:
+            self.positions = changes.positions
+        else:
+            positions = self.positions
+            positions.update(changes.positions)
+            for id in removed:
+                positions.pop(id, None)
+        self.generation = changes.generation
+    
+    def _write(self, changes):
+        removed = []
+        con = self._connect()
+        try:
+            with con:
+                if changes.full:
+                    con.execute("DELETE FROM items")
+                con.executemany(self.INSERT_ITEM, changes.rows)
+                # moved items have been written with their new parent
+                for parent, current in changes.containers:
+                    for row in con.execute(
+                            "SELECT id FROM items WHERE parent = ?", 
+                            (parent,)).fetchall():
+                        if not row[0] in current:
+                            removed.extend([_row[0] for _row in con.execute(
+                                self.SELECT_SUBTREE, (row[0],))])
+                con.executemany("DELETE FROM items WHERE id = ?", 
+                    [(id,) for id in removed])
+                if changes.tags is not None:
+                    con.execute("DELETE FROM tags")
+                    con.executemany(
+                        "INSERT INTO tags (name, description) VALUES (?, ?)",
+                        changes.tags)
+        finally:
+            con.close()
+        return removed
+    
+    def _find_changed(self, container, generation, changed):
+        """ Find containers whose children have been changed. """
+        if generation is None or generation < container.generation:
+            changed.append(container)
+        for child in container.get_children():
+            if child.is_container() and (generation is None or
+                    generation < child.tree_generation):
+                self._find_changed(child, generation, changed)
+    
+    def _take_containers(self, changes, changed, dirty):
+        """ Take rows of children moved or changed in the changed 
+            containers and ids of children to find removed rows. """
+        full = changes.full
+        positions = self.positions
+        written = set(changed)
+        for container in changed:
+            parent = container.id
+            current = set()
+            for position, child in enumerate(container.get_children()):
+                current.add(child.id)
+                stored = positions.get(child.id, None)
+                if full or child in dirty or stored != (parent, position):
+                    changes.add_row(self._row(child, parent, position))
+                if stored is None and child.is_container() and \
+                        not child in written:
+                    # added container keeps its own generation
+                    self._subtree_rows(child, changes, written)
+            if not full:
+                changes.containers.append((parent, current))
+    
+    def _subtree_rows(self, container, changes, written):
+        written.add(container)
+        for position, child in enumerate(container.get_children()):
+            changes.add_row(self._row(child, container.id, position))
+            if child.is_container() and not child in written:
+                self._subtree_rows(child, changes, written)
+    
+    def _row(self, item, parent, position):
+        if item.is_item():
+            return (item.id, parent, position, BookmarksDefs.TYPE_ITEM,
+                    item.name, item.command, item.description,
+                    json.dumps(list(item.tags)))
+        elif item.is_container():
+            return (item.id, parent, position, BookmarksDefs.TYPE_CONTAINER,
+                    item.name, None, item.description, None)
+        return (item.id, parent, position, BookmarksDefs.TYPE_SEPARATOR,
+                None, None, None, None)
+
+
+class DatabaseChanges(object):
+    """ Rows to be written into the database. """
+    
+    def __init__(self, full):
+        self.full = full # all rows are written
+        self.rows = []
+        self.positions = {} # id: (parent, position) of the rows
+        self.containers = [] # (id, ids of children) of changed containers
+        self.tags = None # (name, description) if tags are changed
+        self.generation = None # when taken
+    
+    def add_row(self, row):
+        self.rows.append(row)
+        self.positions[row[0]] = (row[1], row[2])
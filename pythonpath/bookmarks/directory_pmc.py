@@ -149,12 +149,18 @@ class DirectoryPopup(unohelper.Base,
             self.open_document(command)
         
         elif ev.MenuId == self.OPEN_ALL_ID:
+            from bookmarks.openall import OpenAllScheduler
+            # selected again while opening, remaining ones are cancelled
+            if OpenAllScheduler.cancel_running(self.frame):
+                return
             popup = ev.Source
+            tasks = []
             for pos in range(popup.getItemCount()):
                 command = popup.getCommand(popup.getItemId(pos))
                 if command:
-                    # ToDo open in each thread
-                    self.open_document(command)
+                    tasks.append((self.open_document, command, False))
+            OpenAllScheduler.start(self.ctx, self.frame, tasks, 
+                self._label_open_all.replace("~", ""))
     
     def itemHighlighted(self, ev):
         menu = ev.Source
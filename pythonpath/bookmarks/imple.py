@@ -19,8 +19,8 @@ try:
 except:
     from sets import Set as set
 from bookmarks import \
-    CONFIG_NODE_CONTROLLERS, NAME_TREE_STATE, \
-    NAME_WINDOW_STATE, NAME_NAME, DOCUMENT_IMPLE_NAME
+    CONFIG_NODE_CONTROLLERS, CONFIG_NODE_SETTINGS, NAME_TREE_STATE, \
+    NAME_WINDOW_STATE, NAME_NAME, DOCUMENT_IMPLE_NAME, NAME_AUTO_SAVE_DELAY
 from bookmarks.manager import BookmarksManager
 from bookmarks.bookmark import TagContainer
 from bookmarks.command import BookmarksCommandExecutor
@@ -178,6 +178,12 @@ class Task(object):
     
     def _undo(self, controller): pass
     def _redo(self, controller): pass
+    
+    def _record(self, controller, name, *args):
+        """ Record the change into the journal of the bookmarks. """
+        journal = getattr(controller.manager, "journal", None)
+        if journal:
+            getattr(journal, name)(*args)
 
 
 class DeleteTagTask(Task):
@@ -196,6 +202,10 @@ class DeleteTagTask(Task):
             name = tag.get_name()
             for child in tag.get_children():
                 child.add_tag(name)
+                manager.touch_item(child)
+            self._record(controller, "add_tag", 
+                name, tag.get_description())
+            self._record(controller, "set_tags", tag.get_children())
         controller.update_tag_tree()
         for tag in self.tags:
             controller.update_data_view(tag.get_children())
@@ -205,6 +215,7 @@ class DeleteTagTask(Task):
         manager = controller.manager
         for tag in self.tags:
             manager.remove_tag(tag.get_name())
+            self._record(controller, "remove_tag", tag.get_name())
         controller.update_tag_tree()
         for tag in self.tags:
             controller.update_data_view(tag.get_children())
@@ -221,6 +232,45 @@ class StructureTask(Task):
                 parent.append_child(node)
                 if item.get_child_count():
                     self._construct_tree(window, node, item)
+    
+    def _insert_tree_nodes(self, window, parent_node, change):
+        """ Insert nodes for containers inserted by the change. 
+            Nodes at continuous positions are inserted at once. """
+        if not parent_node or not change.containers:
+            return []
+        runs = []
+        for index, item in change.containers:
+            node = window.tree_create_node(item.get_name())
+            node.set_data(item)
+            if runs and runs[-1][0] + len(runs[-1][1]) == index:
+                runs[-1][1].append(node)
+            else:
+                runs.append((index, [node]))
+        nodes = []
+        for index, _nodes in runs:
+            window.tree_insert_nodes(parent_node, index, _nodes)
+            nodes.extend(_nodes)
+        for node in nodes:
+            item = node.get_data()
+            if item.get_child_count():
+                self._construct_tree(window, node, item)
+        return nodes
+    
+    def _remove_tree_nodes(self, parent_node, change):
+        """ Remove nodes for containers removed by the change. """
+        if not parent_node or not change.containers:
+            return
+        children = parent_node.get_children()
+        nodes = []
+        for index, item in change.containers:
+            if index < len(children) and children[index].get_data() == item:
+                node = children[index]
+            else:
+                node = parent_node.find_node_by_data(item)
+            if node:
+                nodes.append(node)
+        if nodes:
+            parent_node.remove_children(nodes)
 
 
 class CutTask(StructureTask):
@@ -244,23 +294,15 @@ class CutTask(StructureTask):
         manager =  controller.manager
         parent = self.parent
         
-        tree_node = window.tree_get_root_node()
         #parent_tree_node = tree_node.find_node_by_data(parent)
         parent_tree_node = controller.get_node_by_data(parent)
-        for position, item in zip(self.positions, self.items):
-            parent.insert_child(manager, position, item)
-            if item.is_container():
-                index = parent.get_child_container_index(item)
-                if 0 <= index:
-                    node = window.tree_create_node(item.get_name())
-                    node.set_data(item)
-                    window.tree_insert_node(parent_tree_node, index, node)
-                    window.tree_make_visible(node)
-                    if item.get_child_count():
-                        self._construct_tree(window, node, item)
+        change = parent.insert_children_at(manager, self.positions, self.items)
+        self._record(controller, "insert", parent, change.positions, self.items)
+        for node in self._insert_tree_nodes(window, parent_tree_node, change):
+            window.tree_make_visible(node)
         
         if controller.check_is_current(parent):
-            controller.insert_items_to_current(-1, self.items, self.positions)
+            controller.insert_items_to_current(-1, self.items, change.positions)
             controller.change_display_item()
         controller.update_tag_tree()
         
@@ -277,15 +319,11 @@ class CutTask(StructureTask):
             tags = dict(manager.tags)
         
         is_current = controller.check_is_current(parent)
-        tree_node = controller.window.tree_get_bookmarks_root()
         #parent_tree_node = tree_node.find_node_by_data(parent)
         parent_tree_node = controller.get_node_by_data(parent)
-        for position in self.positions[::-1]:
-            item = parent.get_child_at(position)
-            parent.remove_child_at(manager, position)
-            node = parent_tree_node.find_node_by_data(item)
-            if node:
-                parent_tree_node.remove_child(node)
+        change = parent.remove_children(manager, self.positions)
+        self._record(controller, "remove", parent, change.positions)
+        self._remove_tree_nodes(parent_tree_node, change)
         
         if is_current:
             controller.remove_items_from_current(positions=self.positions)
@@ -319,15 +357,12 @@ class InsertTask(StructureTask):
         
         is_current = controller.check_is_current(self.parent)
         
-        self.parent.remove_children_at(controller.manager, self.position, len(self.items))
-        tree_node = window.tree_get_root_node()
+        change = self.parent.remove_children_at(
+            controller.manager, self.position, len(self.items))
+        self._record(controller, "remove", self.parent, change.positions)
         #parent_tree_node = tree_node.find_node_by_data(self.parent)
         parent_tree_node = controller.get_node_by_data(self.parent)
-        for item in self.items:
-            if item.is_container():
-                node = parent_tree_node.find_node_by_data(item)
-                if node:
-                    parent_tree_node.remove_child(node)
+        self._remove_tree_nodes(parent_tree_node, change)
         
         #if controller.check_is_current(self.parent):
         if is_current:
@@ -340,19 +375,13 @@ class InsertTask(StructureTask):
         window = controller.window
         manager = controller.manager
         
-        self.parent.insert_children(controller.manager, self.position, self.items)
-        tree_node = window.tree_get_root_node()
+        change = self.parent.insert_children(
+            controller.manager, self.position, self.items)
+        self._record(controller, "insert", 
+            self.parent, change.positions, self.items)
         #parent_tree_node = tree_node.find_node_by_data(self.parent)
         parent_tree_node = controller.get_node_by_data(self.parent)
-        for item in self.items:
-            if item.is_container():
-                index = self.parent.get_child_container_index(item)
-                if 0 <= index:
-                    node = window.tree_create_node(item.get_name())
-                    node.set_data(item)
-                    window.tree_insert_node(parent_tree_node, index, node)
-                    if item.get_child_count():
-                        self._construct_tree(window, node, item)
+        self._insert_tree_nodes(window, parent_tree_node, change)
         
         if controller.check_is_current(self.parent):
             controller.insert_items_to_current(self.position, self.items)
@@ -422,6 +451,7 @@ class MoveTask(StructureTask):
         
         if container_changed:
             container_node.request_structure_update()
+        self._record(controller, "order", source_container)
         
         if controller.check_is_current(source_container):
             min_index = min((min(positions_source), min(positions_dest)))
@@ -433,32 +463,22 @@ class MoveTask(StructureTask):
         window = controller.window
         manager = controller.manager
         
-        tree_root = window.tree_get_root_node()
-        # remove from source
+        # remove from source, tags are not changed by the movement
         #source_container_tree_node = tree_root.find_node_by_data(source_container)
         source_container_tree_node = controller.get_node_by_data(source_container)
-        items = []
-        for position in positions_source[::-1]:
-            item = source_container.remove_child_at(manager, position, update_tag=False)
-            items.append(item)
-            tree_node = source_container_tree_node.find_node_by_data(item)
-            if tree_node:
-                source_container_tree_node.remove_child(tree_node)
-        items.reverse()
+        change = source_container.remove_children(
+                        manager, positions_source, update_tag=False)
+        self._remove_tree_nodes(source_container_tree_node, change)
+        items = change.items
         
         # add to dest
         #dest_container_tree_node = tree_root.find_node_by_data(dest_container)
         dest_container_tree_node = controller.get_node_by_data(dest_container)
-        for position, item in zip(positions_dest, items):
-            dest_container.insert_child(manager, position, item)
-            if item.is_container():
-                index = dest_container.get_child_container_index(item)
-                if 0 <= index:
-                    tree_node = window.tree_create_node(item.get_name())
-                    tree_node.set_data(item)
-                    window.tree_insert_node(dest_container_tree_node, index, tree_node)
-                    if item.get_child_count():
-                        self._construct_tree(window, tree_node, item)
+        change = dest_container.insert_children_at(
+                    manager, positions_dest, items, update_tag=False)
+        self._record(controller, "move", source_container, 
+            positions_source, dest_container, change.positions)
+        self._insert_tree_nodes(window, dest_container_tree_node, change)
         # update view
         if controller.check_is_current(source_container):
             try:
@@ -492,6 +512,8 @@ class SetTagDataTask(Task):
     def _set_data(self, controller, data_type, value):
         if data_type == "name":
             manager = controller.manager
+            self._record(controller, "rename_tag", 
+                self.container.get_name(), value)
             manager.rename_tag(self.container.get_name(), value)
             
             controller.update_tag_tree()
@@ -500,6 +522,9 @@ class SetTagDataTask(Task):
         
         elif data_type == "description":
             self.container.set_description(value)
+            controller.manager.touch_item(self.container)
+            self._record(controller, "tag_description", 
+                self.container.get_name(), value)
             if controller.check_is_current(self.container):
                 controller.change_display_container()
 
@@ -529,6 +554,8 @@ class ChangeTagTask(Task):
             for tag in self.removed_tags:
                 manager.add_tag_group(
                     tag.get_name(), tag.get_description())
+                self._record(controller, "add_tag", 
+                    tag.get_name(), tag.get_description())
         
         for name in added:
             tag = manager.get_tag(name, create=True)
@@ -540,7 +567,10 @@ class ChangeTagTask(Task):
             for item in self.items:
                 item.remove_tag(name)
         # items are removed by the checking
-        self.removed_tags = manager.check_tag_containers()
+        self.removed_tags = manager.check_tag_containers(removed, self.items)
+        for item in self.items:
+            manager.touch_item(item)
+        self._record(controller, "set_tags", self.items)
         controller.update_tag_tree()
         controller.update_data_view(self.items)
 
@@ -582,6 +612,8 @@ class SetDataTask(Task):
         elif data_type == "description" and \
             (item.is_item() or item.is_container()):
             self.item.set_description(value)
+        controller.manager.touch_item(item)
+        self._record(controller, "set_data", item, data_type, value)
         
         if controller.check_is_current(parent):
             index = parent.get_child_index(item)
@@ -921,6 +953,33 @@ class BookmarksControllerImple(object):
         self._init_tree(settings)
         if self.__class__.is_locked(self.command):
             self._lock()
+        self._init_auto_saver()
+    
+    def _init_auto_saver(self):
+        """ Start auto saving if enabled. """
+        self.auto_saver = None
+        try:
+            delay = get_config_value(
+                self.ctx, CONFIG_NODE_SETTINGS, NAME_AUTO_SAVE_DELAY)
+        except Exception as e:
+            print(e)
+            delay = 0
+        if delay and delay > 0:
+            from bookmarks.autosave import AutoSaver
+            self.auto_saver = AutoSaver(
+                self.ctx, self.manager, delay, self._auto_saved)
+            self.auto_saver.start()
+    
+    def _auto_saved(self):
+        """ Called after the bookmarks have been stored automatically. """
+        if self.controller:
+            self.controller.update_save_state()
+        anotherpmc.set_modified(self.ctx, self.command)
+    
+    def request_auto_save(self):
+        """ Request to store modified bookmarks after the delay. """
+        if self.auto_saver:
+            self.auto_saver.request()
     
     def _init_tree(self, settings):
         """ Construct tree. """
@@ -939,10 +998,8 @@ class BookmarksControllerImple(object):
             self._(self.manager.TAGS_DEFALUT_NAME))
         tags_root_node.set_data(self.manager)
         window.tree_get_root_node().append_child(tags_root_node)
-        tags = [(name, tag) for name, tag in self.manager.tags.items()]
-        tags.sort()
-        for name, tag in tags:
-            tag_node = window.tree_create_tag_node(name)
+        for tag in self.manager.get_children():
+            tag_node = window.tree_create_tag_node(tag.get_name())
             tag_node.set_data(tag)
             tags_root_node.append_child(tag_node)
         
@@ -1028,6 +1085,11 @@ class BookmarksControllerImple(object):
             )
         except Exception as e:
             print(e)
+        if self.auto_saver:
+            self.auto_saver.stop()
+            self.auto_saver = None
+        from bookmarks.usage import BookmarksUsage
+        BookmarksUsage.flush_all()
         self.window.closed()
         self.window = None
         self.manager = None
@@ -1061,6 +1123,7 @@ class BookmarksControllerImple(object):
             self.manager.set_modified()
             self.controller.update_undo_redo_state()
             self.controller.update_save_state()
+            self.request_auto_save()
         except Exception as e:
             print(e)
             traceback.print_exc()
@@ -1141,7 +1204,11 @@ class BookmarksControllerImple(object):
         if replace:
             window.grid_set_rows(tuple(rows))
         else:
-            if not positions is None:
+            if positions and \
+                list(positions) == list(range(positions[0], positions[0] + len(rows))):
+                # continuous rows
+                window.grid_insert_rows(positions[0], tuple(rows))
+            elif not positions is None:
                 for position, row in zip(positions, rows):
                     window.grid_insert_row(position, row)
             else:
@@ -1735,6 +1802,11 @@ class BookmarksControllerImple(object):
                 from bookmarks import TAG_POPUP_IMPLE_NAME
                 imple_name = TAG_POPUP_IMPLE_NAME
                 controller = self
+                
+            elif command.startswith(self.commands.USAGE_POPUP_URI):
+                from bookmarks import USAGE_POPUP_IMPLE_NAME
+                imple_name = USAGE_POPUP_IMPLE_NAME
+                controller = self
             
             if imple_name:
                 try:
@@ -1744,14 +1816,14 @@ class BookmarksControllerImple(object):
                     pass
             else:
                 try:
-                    self.commands.execute_command(command)
+                    self.commands.execute_item(item)
                 except:
                     pass
         else:
             for item in items:
                 if item.is_item():
                     try:
-                        self.commands.execute_command(item.get_command())
+                        self.commands.execute_item(item)
                     except:
                         pass
     
@@ -1894,7 +1966,8 @@ class BookmarksControllerImple(object):
             return
         # 0: cancel, 2: Yes, 3: no
         if n == 2:
-            self.do_Save()
+            if not self.do_Save():
+                return False
         elif n == 0:
             return False
         return True
@@ -2115,6 +2188,7 @@ class BookmarksControllerImple(object):
                 self.manager.set_modified()
                 self.controller.update_undo_redo_state()
                 self.controller.update_save_state()
+                self.request_auto_save()
             except Exception as e:
                 print(e)
                 traceback.print_exc()
@@ -2127,6 +2201,7 @@ class BookmarksControllerImple(object):
                 self.manager.set_modified()
                 self.controller.update_undo_redo_state()
                 self.controller.update_save_state()
+                self.request_auto_save()
             except Exception as e:
                 print(e)
                 traceback.print_exc()
@@ -2196,13 +2271,13 @@ class BookmarksControllerImple(object):
         
         from bookmarks.dialog import FileOpenDialog
         result = FileOpenDialog(self.ctx, self.res, 
-            filters=(("JSON (*.json)", "*.json"),)
+            filters=(("JSON (*.json)", "*.json;*.json.gz"),)
         ).execute()
         if result:
             from bookmarks.manager import BookmarksManager
             try:
-                import uno
-                obj = BookmarksManager.load(uno.fileUrlToSystemPath(result))
+                data = self.manager._read_bytes(result)[0]
+                obj = BookmarksManager.load(data.decode("utf-8"))
                 container = obj[BookmarksManager.NAME_BOOKMARKS]
                 if isinstance(container, list):
                     items = container
@@ -2219,7 +2294,8 @@ class BookmarksControllerImple(object):
         from bookmarks.dialog import FileSaveAutoExtensionAndSelectionDialog
         dialog = FileSaveAutoExtensionAndSelectionDialog(
             self.ctx, self.res, 
-            filters=(("JSON (*.json)", "*.json"), ), 
+            filters=(("JSON (*.json)", "*.json"), 
+                ("Compressed JSON (*.json.gz)", "*.json.gz")), 
             default=self.manager.bookmark_name, 
         )
         result = dialog.execute()
@@ -2273,8 +2349,10 @@ class BookmarksControllerImple(object):
         if items:
             try:
                 obj = self.manager.pack(tags, items, unsorted)
-                s = self.manager.__class__.dump(obj)
-                self.manager._write_to_file(file_url, s)
+                klass = self.manager.__class__
+                chunks = klass.compress_chunks(
+                    klass.iterdump(obj), klass.compression_for(file_url))
+                self.manager._write_to_file(file_url, chunks)
             except Exception as e:
                 print(e)
     
@@ -2291,13 +2369,19 @@ class BookmarksControllerImple(object):
             self.window.message(self._("Older bookmarks menu was not found."), "")
     
     def do_Save(self):
+        """ Returns False if failed to store. """
         if self.manager.modified:
             try:
-                self.manager.store()
+                if not self.manager.store():
+                    self.window.message(
+                        self._("Failed to save the bookmarks."), "", True)
+                    return False
                 self.controller.update_save_state()
                 anotherpmc.set_modified(self.ctx, self.command)
             except Exception as e:
                 print(e)
+                return False
+        return True
     
     def do_NewMenu(self):
         try:
@@ -0,0 +1,270 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import json
+import traceback
+
+from bookmarks.bookmark import BookmarksDefs, BaseItem
+
+
+class BookmarksJournal(object):
+    """ Append-only journal of changes, kept next to the bookmarks file.
+    
+        Each line is an entry in JSON. The first line has serial of
+        the snapshot which the journal is applied to. Entries are
+        kept in memory until flush, which is called by store.
+    """
+    
+    EXTENSION = ".journal"
+    
+    OP_SNAPSHOT = "snapshot"
+    OP_INSERT = "insert"
+    OP_REMOVE = "remove"
+    OP_MOVE = "move"
+    OP_ORDER = "order"
+    OP_SET = "set"
+    OP_TAGS = "tags"
+    OP_ADD_TAG = "add_tag"
+    OP_REMOVE_TAG = "remove_tag"
+    OP_RENAME_TAG = "rename_tag"
+    OP_TAG_DESCRIPTION = "tag_description"
+    
+    def create(file_url, serial):
+        """ Returns journal for the local file, otherwise None. """
+        if not file_url or not file_url.startswith("file:"):
+            return None
+        import uno
+        return BookmarksJournal(
+            uno.fileUrlToSystemPath(file_url) + BookmarksJournal.EXTENSION,
+            serial)
+    
+    create = staticmethod(create)
+    
+    def __init__(self, path, serial):
+        self.path = path
+        self.serial = serial # of the snapshot
+        self.entries = [] # not yet written
+        self.size = 0 # of the file
+        self.stale = False # file is not for the snapshot
+        self.broken = False # failed to replay
+    
+    def has_entries(self):
+        return len(self.entries) > 0
+    
+    def needs_compaction(self, limit):
+        """ Check the journal should be folded into the snapshot. """
+        return self.stale or self.broken or self.size > limit
+    
+    def take_entries(self):
+        """ Returns entries not yet written and clear them. """
+        entries = self.entries
+        self.entries = []
+        return entries
+    
+    def _append(self, op, **values):
+        values["op"] = op
+        self.entries.append(values)
+    
+    def insert(self, parent, positions, items):
+        self._append(self.OP_INSERT, parent=parent.get_id(),
+            positions=list(positions),
+            items=[item.as_json() for item in items])
+    
+    def remove(self, parent, positions):
+        self._append(self.OP_REMOVE, parent=parent.get_id(),
+            positions=list(positions))
+    
+    def move(self, source, source_positions, dest, dest_positions):
+        self._append(self.OP_MOVE,
+            source=source.get_id(), source_positions=list(source_positions),
+            dest=dest.get_id(), dest_positions=list(dest_positions))
+    
+    def order(self, container):
+        """ Order of children in the container has been changed. """
+        self._append(self.OP_ORDER, parent=container.get_id(),
+            children=[child.get_id() for child in container.get_children()])
+    
+    def set_data(self, item, data_type, value):
+        self._append(self.OP_SET, id=item.get_id(),
+            data=data_type, value=value)
+    
+    def set_tags(self, items):
+        """ Tags of the items have been changed. """
+        self._append(self.OP_TAGS,
+            items=[[item.get_id(), list(item.get_tags())] for item in items])
+    
+    def add_tag(self, name, description):
+        self._append(self.OP_ADD_TAG, name=name, description=description)
+    
+    def remove_tag(self, name):
+        self._append(self.OP_REMOVE_TAG, name=name)
+    
+    def rename_tag(self, old_name, new_name):
+        self._append(self.OP_RENAME_TAG, name=old_name, new_name=new_name)
+    
+    def tag_description(self, name, description):
+        self._append(self.OP_TAG_DESCRIPTION, name=name,
+            description=description)
+    
+    def _encode(self, entry):
+        return (json.dumps(entry, ensure_ascii=False, sort_keys=True) +
+                "\n").encode("utf-8")
+    
+    def flush(self, entries=None):
+        """ Append entries to the file. If entries is not specified, 
+            entries not yet written are taken. """
+        if entries is None:
+            entries = self.take_entries()
+        if not entries:
+            return
+        lines = []
+        mode = "ab"
+        if not self.size:
+            lines.append(self._encode(
+                {"op": self.OP_SNAPSHOT, "serial": self.serial}))
+            mode = "wb"
+        for entry in entries:
+            lines.append(self._encode(entry))
+        data = b"".join(lines)
+        f = open(self.path, mode)
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        self.size += len(data)
+    
+    def reset(self, serial):
+        """ Clear the journal after the snapshot has been written. 
+            Entries recorded after the snapshot was taken are kept. """
+        self.serial = serial
+        self.stale = False
+        self.broken = False
+        self.size = 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def replay(self, manager):
+        """ Apply the journal to the bookmarks, returns number of
+            applied entries. """
+        if not os.path.exists(self.path):
+            return 0
+        f = open(self.path, "rb")
+        try:
+            lines = f.read().split(b"\n")
+        finally:
+            f.close()
+        self.size = os.path.getsize(self.path)
+        try:
+            header = json.loads(lines[0].decode("utf-8"))
+            if header.get("op") != self.OP_SNAPSHOT or \
+                    header.get("serial") != self.serial:
+                self.stale = True
+                return 0
+        except ValueError:
+            self.stale = True
+            return 0
+        n = 0
+        for line in lines[1:]:
+            if not line:
+                continue
+            try:
+                entry = json.loads(line.decode("utf-8"))
+            except ValueError:
+                # incomplete last entry
+                break
+            try:
+                getattr(self, "_replay_" + entry["op"])(manager, entry)
+            except Exception as e:
+                print(e)
+                traceback.print_exc()
+                self.broken = True
+                break
+            n += 1
+        return n
+    
+    def _create_item(self, o):
+        if o.get(BookmarksDefs.NAME_TYPE) == BookmarksDefs.TYPE_CONTAINER:
+            NAME_CHILDREN = BookmarksDefs.NAME_CHILDREN
+            o[NAME_CHILDREN] = [self._create_item(child)
+                                    for child in o.get(NAME_CHILDREN, ())]
+        return BaseItem.create(o)
+    
+    def _get_item(self, manager, id):
+        item = manager.get_item(id)
+        if item is None:
+            raise KeyError("Item not found: %s" % id)
+        return item
+    
+    def _replay_insert(self, manager, entry):
+        parent = self._get_item(manager, entry["parent"])
+        items = [self._create_item(o) for o in entry["items"]]
+        parent.insert_children_at(manager, entry["positions"], items)
+    
+    def _replay_remove(self, manager, entry):
+        parent = self._get_item(manager, entry["parent"])
+        parent.remove_children(manager, entry["positions"])
+    
+    def _replay_move(self, manager, entry):
+        source = self._get_item(manager, entry["source"])
+        dest = self._get_item(manager, entry["dest"])
+        change = source.remove_children(
+            manager, entry["source_positions"], update_tag=False)
+        dest.insert_children_at(
+            manager, entry["dest_positions"], change.items, update_tag=False)
+    
+    def _replay_order(self, manager, entry):
+        container = self._get_item(manager, entry["parent"])
+        children = dict([(child.get_id(), child)
+                            for child in container.get_children()])
+        container.children = [children[id] for id in entry["children"]]
+        container.touch()
+    
+    def _replay_set(self, manager, entry):
+        item = self._get_item(manager, entry["id"])
+        data_type = entry["data"]
+        value = entry["value"]
+        if data_type == "name" and \
+            (item.is_item() or item.is_container()):
+            item.set_name(value)
+        elif data_type == "command" and item.is_item():
+            item.set_command(value)
+        elif data_type == "description" and \
+            (item.is_item() or item.is_container()):
+            item.set_description(value)
+        manager.touch_item(item)
+    
+    def _replay_tags(self, manager, entry):
+        for id, names in entry["items"]:
+            item = self._get_item(manager, id)
+            removed = [name for name in item.get_tags() if not name in names]
+            item.set_tags(names)
+            manager.check_tag_for_remove(removed, item)
+            manager.check_tag(item)
+            manager.touch_item(item)
+    
+    def _replay_add_tag(self, manager, entry):
+        tag = manager.add_tag_group(entry["name"], entry["description"])
+        tag.set_description(entry["description"])
+    
+    def _replay_remove_tag(self, manager, entry):
+        manager.remove_tag(entry["name"])
+    
+    def _replay_rename_tag(self, manager, entry):
+        manager.rename_tag(entry["name"], entry["new_name"])
+    
+    def _replay_tag_description(self, manager, entry):
+        manager.get_tag(entry["name"]).set_description(entry["description"])
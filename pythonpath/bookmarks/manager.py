@@ -13,16 +13,26 @@
 #  limitations under the License.
 
 import os
+import gc
 import time
 import json
+import zlib
+import threading
 import traceback
 import uno
 
 from bookmarks.bookmark import BookmarksManagerBase, \
-    BaseItem, Item, Separator, Container, TagContainer
+    BaseItem, Item, Separator, Container, TagContainer, BookmarksDefs, \
+    next_generation
+from bookmarks.database import BookmarksDatabase
+from bookmarks.journal import BookmarksJournal
 
 import sys
 is_python3 = sys.version_info[0] >= 3
+if is_python3:
+    string_types = str
+else:
+    string_types = basestring
 del sys
 
 
@@ -40,6 +50,22 @@ class BookmarksManager(BookmarksManagerBase):
     NAME_TAGS = "tags"
     NAME_BOOKMARKS = "bookmarks"
     NAME_UNSORTED = "unsorted"
+    NAME_JOURNAL = "journal"
+    NAME_LAST_ID = "last_id"
+    
+    # children of containers are created when they are requested
+    LAZY_LOAD = True
+    # print time taken by each phase of loading
+    TRACE_LOAD = False
+    # changes are appended to the journal instead of writing whole file, 
+    # these are replaced by the configuration
+    USE_JOURNAL = False
+    # size of the journal to be folded into the file
+    JOURNAL_LIMIT = 0x100000
+    # ids are kept while the journal is used, they are renumbered when 
+    # the journal is folded after they exceed this, ids of menu entries 
+    # are short
+    ID_LIMIT = 0x3fff
     
     Managers = {}
     
@@ -54,9 +80,10 @@ class BookmarksManager(BookmarksManagerBase):
     def remove(id):
         klass = BookmarksManager
         try:
-            klass.Managers.pop(id)
+            manager = klass.Managers.pop(id)
         except:
-            pass
+            return
+        manager.dispose()
     
     get = staticmethod(get)
     remove = staticmethod(remove)
@@ -68,11 +95,43 @@ class BookmarksManager(BookmarksManagerBase):
         self.command = command
         self.last_modified = 0
         self.modified = False
+        self.load_phases = [] # (name, seconds) of the last open
+        self.database = None # set if the file is database
+        self.journal = None # set if changes are kept in journal
+        self.store_lock = threading.Lock() # held from snapshot to writing
+        self.backups = None # snapshots in the backup directory
+        self.compression = None # of the file
         self.file_url = self.command_to_path(ctx, command)
         self.bookmark_name = name
+        self.load_config()
         if self.file_url:
             self.open(self.file_url)
     
+    def load_config(self):
+        """ Read settings of the journal. """
+        from bookmarks import CONFIG_NODE_SETTINGS, \
+            NAME_USE_JOURNAL, NAME_JOURNAL_LIMIT
+        from bookmarks.tools import get_config
+        try:
+            config = get_config(self.ctx, CONFIG_NODE_SETTINGS)
+            self.USE_JOURNAL = config.getPropertyValue(NAME_USE_JOURNAL)
+            self.JOURNAL_LIMIT = config.getPropertyValue(NAME_JOURNAL_LIMIT)
+        except Exception as e:
+            print(e)
+    
+    def dispose(self):
+        """ Release data kept for this bookmarks. """
+        try:
+            from bookmarks.usage import BookmarksUsage
+            BookmarksUsage.release(self)
+        except Exception as e:
+            print(e)
+        try:
+            from bookmarks.bookmarks_pmc import MenuEntries
+            MenuEntries.release(self)
+        except Exception as e:
+            print(e)
+    
     def __repr__(self):
         return "<%s.%s %s at %s>" % (
             self.__class__.__module__, 
@@ -81,12 +140,20 @@ class BookmarksManager(BookmarksManagerBase):
     def set_modified(self, state=True):
         """ Update modified state. """
         self.modified = state
-        self.last_modified = time.time()
+        self.last_modified = next_generation()
     
-    def is_modified_since(self, value):
-        return value < self.last_modified
+    def touch_item(self, item):
+        """ Mark the item to be written into the database too. """
+        BookmarksManagerBase.touch_item(self, item)
+        if self.database:
+            self.database.mark_dirty(item)
+    
+    def is_modified_since(self, generation):
+        """ Check bookmarks have been changed after the generation. """
+        return generation < self.last_modified
     
     def get_last_modified(self):
+        """ Returns generation of the last modification. """
         return self.last_modified
     
     def has_location(self):
@@ -99,58 +166,235 @@ class BookmarksManager(BookmarksManagerBase):
         obj.set_id(1)
         return obj
     
-    def _read_from_file(self, file_url):
-        """ Read string from the file. """
+    READ_CHUNK_SIZE = 0x10000
+    
+    COMPRESSION_GZIP = "gzip"
+    COMPRESSION_ZLIB = "zlib"
+    # extensions of new files to be compressed
+    COMPRESSED_EXTENSIONS = {
+        ".gz": COMPRESSION_GZIP, 
+        ".zlib": COMPRESSION_ZLIB, 
+    }
+    # wbits of zlib for each compression
+    COMPRESSION_WBITS = {
+        COMPRESSION_GZIP: 16 + zlib.MAX_WBITS, 
+        COMPRESSION_ZLIB: zlib.MAX_WBITS, 
+    }
+    COMPRESSION_LEVEL = 6
+    
+    def detect_compression(data):
+        """ Detect compression from leading bytes. """
+        if len(data) < 2:
+            return None
+        first = bytearray(data[:2])
+        if first[0] == 0x1f and first[1] == 0x8b:
+            return BookmarksManager.COMPRESSION_GZIP
+        if first[0] & 0x0f == 8 and (first[0] << 8 | first[1]) % 31 == 0:
+            # JSON never starts with these bytes
+            return BookmarksManager.COMPRESSION_ZLIB
+        return None
+    
+    detect_compression = staticmethod(detect_compression)
+    
+    def compression_for(file_url):
+        """ Compression for the new file by its extension. """
+        ext = os.path.splitext(file_url or "")[1].lower()
+        return BookmarksManager.COMPRESSED_EXTENSIONS.get(ext, None)
+    
+    compression_for = staticmethod(compression_for)
+    
+    def decompress_chunks(chunks, compression):
+        """ Decompress iterator of chunks. """
+        if compression is None:
+            for chunk in chunks:
+                yield chunk
+            return
+        decompressor = zlib.decompressobj(
+            BookmarksManager.COMPRESSION_WBITS[compression])
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        data = decompressor.flush()
+        if data:
+            yield data
+    
+    decompress_chunks = staticmethod(decompress_chunks)
+    
+    def compress_chunks(chunks, compression):
+        """ Compress iterator of chunks. """
+        if compression is None:
+            for chunk in chunks:
+                yield chunk
+            return
+        compressor = zlib.compressobj(
+            BookmarksManager.COMPRESSION_LEVEL, zlib.DEFLATED, 
+            BookmarksManager.COMPRESSION_WBITS[compression])
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    
+    compress_chunks = staticmethod(compress_chunks)
+    
+    def _iter_file(self, file_url):
+        """ Read the file in chunks. Local file is read directly, 
+            others are read through SimpleFileAccess. """
+        chunk_size = self.READ_CHUNK_SIZE
+        if file_url.startswith("file:"):
+            try:
+                f = open(uno.fileUrlToSystemPath(file_url), "rb")
+            except IOError as e:
+                print(e)
+            else:
+                try:
+                    while True:
+                        data = f.read(chunk_size)
+                        if not data:
+                            break
+                        yield data
+                finally:
+                    f.close()
+                return
         import bookmarks.tools
         sfa = bookmarks.tools.create_service(
                 self.ctx, "com.sun.star.ucb.SimpleFileAccess")
         io = sfa.openFileRead(file_url)
-        ret = None
-        if is_python3:
-            try:
-                text = bytes()
-                while True:
-                    n, data = io.readBytes(None, 0xffff)
-                    text += data.value
-                    if n < 0xffff:
-                        break
-            except Exception as e:
-                print(e)
-            ret = text.decode("utf-8")
-        else:
-            try:
-                text = []
-                while True:
-                    n, data = io.readBytes(None, 0xffff)
-                    text.append(data.value)
-                    if n < 0xffff:
-                        break
-            except Exception as e:
-                print(e)
-            ret = "".join(text).decode("utf-8")
-        io.closeInput()
-        return ret
+        try:
+            while True:
+                n, data = io.readBytes(None, chunk_size)
+                yield data.value
+                if n < chunk_size:
+                    break
+        except Exception as e:
+            print(e)
+        finally:
+            io.closeInput()
+    
+    def _get_file_size(self, file_url):
+        """ Returns size of the file or None if unknown. """
+        try:
+            if file_url.startswith("file:"):
+                return os.path.getsize(uno.fileUrlToSystemPath(file_url))
+            import bookmarks.tools
+            sfa = bookmarks.tools.create_service(
+                    self.ctx, "com.sun.star.ucb.SimpleFileAccess")
+            return sfa.getSize(file_url)
+        except Exception as e:
+            print(e)
+        return None
+    
+    def _read_bytes(self, file_url):
+        """ Read the file and decompress it if compressed. 
+            Returns tuple of bytearray and its compression. 
+            Uncompressed file is read into the buffer of its size. """
+        chunks = self._iter_file(file_url)
+        first = b""
+        for chunk in chunks:
+            first += chunk
+            if len(first) >= 2:
+                break
+        compression = self.__class__.detect_compression(first)
+        def all_chunks():
+            yield first
+            for chunk in chunks:
+                yield chunk
+        if compression is None:
+            size = self._get_file_size(file_url)
+            if size:
+                data = bytearray(size)
+                pos = 0
+                for chunk in all_chunks():
+                    end = pos + len(chunk)
+                    data[pos:end] = chunk
+                    pos = end
+                if pos < len(data):
+                    # changed while reading
+                    del data[pos:]
+                return data, compression
+        data = bytearray()
+        for chunk in self.__class__.decompress_chunks(
+                all_chunks(), compression):
+            data.extend(chunk)
+        return data, compression
+    
+    def _read_from_file(self, file_url):
+        """ Read string from the file. The compression of the file is 
+            kept to write the file in the same way. """
+        data, self.compression = self._read_bytes(file_url)
+        return data.decode("utf-8")
     
     def _write_to_file(self, file_url, text):
-        """ Write text to the file. """
+        """ Write text to the file. The text is written into temporary 
+            file next to the file and it is renamed to the file after 
+            the writing is finished. The text can be iterator of bytes. 
+            Returns True if the file is written. 
+        """
+        if isinstance(text, bytes):
+            text = (text,)
+        if file_url.startswith("file:"):
+            try:
+                self._write_to_local_file(
+                    uno.fileUrlToSystemPath(file_url), text)
+                return True
+            except (IOError, OSError) as e:
+                # the text might be consumed
+                print(e)
+                return False
         import bookmarks.tools
-        import uno
         sfa = bookmarks.tools.create_service(
                 self.ctx, "com.sun.star.ucb.SimpleFileAccess")
-        if sfa.exists(file_url):
-            sfa.kill(file_url)
-        io = sfa.openFileWrite(file_url)
+        temp_url = file_url + ".tmp"
         try:
-            total = len(text)-1
-            n = 0
-            while True:
-                io.writeBytes(uno.ByteSequence(text[n:n+0xffff]))
-                n += 0xffff
-                if n >= total:
-                    break
+            if sfa.exists(temp_url):
+                sfa.kill(temp_url)
+            io = sfa.openFileWrite(temp_url)
+            try:
+                for chunk in text:
+                    io.writeBytes(uno.ByteSequence(chunk))
+                io.flush()
+            finally:
+                io.closeOutput()
+            if sfa.exists(file_url):
+                sfa.kill(file_url)
+            sfa.move(temp_url, file_url)
+            return True
         except Exception as e:
             print(e)
-        io.closeOutput()
+        return False
+    
+    def _write_to_local_file(self, path, text):
+        """ Write chunks of text to local file through temporary file. """
+        import tempfile
+        dir_path = os.path.dirname(path)
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        fd, temp_path = tempfile.mkstemp(
+            prefix=".%s" % os.path.basename(path), suffix=".tmp", 
+            dir=dir_path)
+        try:
+            if os.path.exists(path):
+                # mkstemp creates the file readable only by the owner
+                os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+            f = os.fdopen(fd, "wb")
+            try:
+                for chunk in text:
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            if hasattr(os, "replace"):
+                os.replace(temp_path, path)
+            else:
+                if os.name == "nt" and os.path.exists(path):
+                    os.remove(path)
+                os.rename(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
     
     def open(self, file_url=None, fallback=True):
         """ Open and load data. """
@@ -159,12 +403,26 @@ class BookmarksManager(BookmarksManagerBase):
             from bookmarks.tools import get_current_resource
             return get_current_resource(self.ctx, RES_DIR, RES_FILE)
         
+        lazy = self.LAZY_LOAD
+        keep_id = False
+        self.compression = None
+        self.load_phases = []
+        start = time.time()
         obj = None
         if file_url is None:
             file_url = self.file_url
-        if self.has_location():
+        self.database = BookmarksDatabase.create(file_url)
+        if self.database:
+            lazy = False
+            if self.has_location():
+                obj = self._load_from_database()
+                keep_id = not obj is None
+                start = self._load_phase("decode", start)
+        elif self.has_location():
             s = self._read_from_file(file_url)
-            obj = self.__class__.load(s)
+            start = self._load_phase("read", start)
+            obj = self.__class__.load(s, lazy)
+            start = self._load_phase("decode", start)
         if not obj:
             if fallback:
                 # search in extension package
@@ -172,13 +430,78 @@ class BookmarksManager(BookmarksManagerBase):
                     self.ctx, self.command, fallback=True)
                 if file_url:
                     s = self._read_from_file(file_url)
-                    obj = self.__class__.load(s)
+                    start = self._load_phase("read", start)
+                    obj = self.__class__.load(s, lazy)
+                    start = self._load_phase("decode", start)
             if not obj:
                 res = load_res()
                 obj = self.create_simple_base(res)
-        if file_url:
+                lazy = False
+        s = None # release the text before creating items
+        if not keep_id and self.NAME_JOURNAL in obj:
+            # the journal refers items by ids written in the file
+            keep_id = True
+        if file_url and self.database is None:
             self.file_url = file_url
+            if self.compression is None:
+                self.compression = self.__class__.compression_for(file_url)
+        if lazy:
+            self._open_lazy(obj, load_res, keep_id)
+        else:
+            self._open_items(obj, load_res, keep_id)
+        if keep_id and self.database:
+            self.database.set_synchronized()
+        start = self._load_phase("index", start)
+        self._open_journal(obj)
+        self._load_phase("journal", start)
+        if self.TRACE_LOAD:
+            print("%s: %s" % (self.file_url, ", ".join(
+                ["%s %.3f s" % phase for phase in self.load_phases])))
+    
+    def _load_phase(self, name, start):
+        """ Record time taken by the phase of open. """
+        now = time.time()
+        self.load_phases.append((name, now - start))
+        return now
+    
+    def _open_journal(self, obj):
+        """ Apply changes kept in the journal to the loaded bookmarks. """
+        self.journal = None
+        if self.database:
+            return
+        serial = obj.get(self.NAME_JOURNAL, 0)
+        journal = BookmarksJournal.create(self.file_url, serial)
+        if journal is None or \
+                not (self.USE_JOURNAL or os.path.exists(journal.path)):
+            return
+        self.journal = journal
+        # ids in the journal are kept, next_id follows them
+        journal.replay(self)
+        if not self.USE_JOURNAL:
+            # disabled, folded into the file at the next store
+            journal.stale = True
+    
+    def _load_from_database(self):
+        """ Load bookmarks from database. """
+        try:
+            loaded = self.database.load()
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
+            return None
+        if loaded:
+            tags, base, unsorted = loaded
+            obj = {self.NAME_TAGS: tags, self.NAME_BOOKMARKS: base}
+            if not unsorted is None:
+                obj[self.NAME_UNSORTED] = unsorted
+            return obj
+    
+    def _open_items(self, obj, load_res, keep_id=False):
+        """ Load from decoded bookmarks. Ids are reassigned, items are 
+            registered and added to their tags in one pass. Ids stored 
+            in database or the file are kept if keep_id. """
         self.data = obj
+        self.reserve_ids(0)
         
         if self.NAME_BOOKMARKS in obj:
             self.base = obj[self.NAME_BOOKMARKS]
@@ -187,7 +510,8 @@ class BookmarksManager(BookmarksManagerBase):
             self.base = self.create_base(res)
         
         if self.NAME_TAGS in obj:
-            self.tags.update(obj[self.NAME_TAGS])
+            for tag in obj[self.NAME_TAGS].values():
+                self.add_tag_container(tag)
         
         if self.NAME_UNSORTED in obj:
             self.unsorted = obj[self.NAME_UNSORTED]
@@ -195,27 +519,235 @@ class BookmarksManager(BookmarksManagerBase):
             res = load_res()
             self.unsorted = self.create_unsorted(res)
         
-        self.reassign_all() # reduce id problem
-        self.assign_id(self.unsorted)
-        self.containers[self.unsorted.get_id()] = self.unsorted
-        self.last_modified = time.time()
-        self.update_tags(self.base)
-        self.update_tags(self.unsorted)
+        if keep_id:
+            self.clear_containers()
+            self.register_item(self.base, True)
+            self.register_item(self.unsorted, True)
+            self._id = max(self.items)
+            if not self.database:
+                self._id = max(self._id, obj.get(self.NAME_LAST_ID, 0))
+                self.reserve_ids(self._id)
+            self.update_tags_of((self.base, self.unsorted))
+            self.last_modified = next_generation()
+            return
+        # reassign all ids to reduce id problem
+        self.reset_id()
+        self.clear_containers()
+        self.base.set_id(self.next_id())
+        tagged = {}
+        for container in (self.base, self.unsorted):
+            self.register_item(container)
+            self.index_tree(container, tagged)
+        self.update_tagged(tagged)
+        self.last_modified = next_generation()
+    
+    def _open_lazy(self, obj, load_res, keep_id=False):
+        """ Load from undecoded dicts. Items are created when their 
+            container is requested. Ids are assigned to the dicts in the 
+            same order as reassign_all and tag names are collected 
+            without creating items. Ids in the dicts are kept if keep_id. """
+        NAME_ID = BookmarksDefs.NAME_ID
+        NAME_PARENT = BookmarksDefs.NAME_PARENT
+        NAME_TYPE = BookmarksDefs.NAME_TYPE
+        NAME_CHILDREN = BookmarksDefs.NAME_CHILDREN
+        NAME_TAGS = BookmarksDefs.NAME_TAGS
+        TYPE_ITEM = BookmarksDefs.TYPE_ITEM
+        TYPE_CONTAINER = BookmarksDefs.TYPE_CONTAINER
+        next_id = self.next_id
+        names = set()
+        
+        def walk(o):
+            parent_id = o[NAME_ID]
+            for child in o.get(NAME_CHILDREN, ()):
+                if keep_id:
+                    last_id[0] = max(last_id[0], child[NAME_ID])
+                else:
+                    child[NAME_ID] = next_id()
+                child[NAME_PARENT] = parent_id
+                type = child.get(NAME_TYPE, None)
+                if type == TYPE_CONTAINER:
+                    walk(child)
+                elif type == TYPE_ITEM:
+                    names.update(child.get(NAME_TAGS, ()))
+        
+        if not self.NAME_BOOKMARKS in obj:
+            obj[self.NAME_BOOKMARKS] = self.create_base(load_res()).as_json()
+        if not self.NAME_UNSORTED in obj:
+            obj[self.NAME_UNSORTED] = \
+                self.create_unsorted(load_res()).as_json()
+        
+        self.reset_id()
+        self.clear_containers()
+        base = obj[self.NAME_BOOKMARKS]
+        last_id = [obj.get(self.NAME_LAST_ID, 0)]
+        if keep_id:
+            last_id[0] = max(last_id[0], base[NAME_ID])
+        else:
+            base[NAME_ID] = next_id()
+        walk(base)
+        unsorted = obj[self.NAME_UNSORTED]
+        walk(unsorted)
+        if keep_id:
+            self._id = last_id[0]
+        # children of pending containers have these ids
+        self.reserve_ids(self._id)
+        
+        self.base = BaseItem.create(base, self)
+        self.unsorted = BaseItem.create(unsorted, self)
+        self.register_item(self.base)
+        self.register_item(self.unsorted)
+        
+        if self.NAME_TAGS in obj:
+            for tag in obj[self.NAME_TAGS].values():
+                self.add_tag_container(TagContainer.create(tag))
+        for name in names:
+            self.add_tag_group(name)
+        # items are added to tags when a tag is requested
+        self.pending = True
+        self.data = self.pack(self.tags, self.base, self.unsorted)
+        self.last_modified = next_generation()
+    
+    def load_pending(self):
+        """ Create all lazily loaded items and add them to their tags. """
+        if self.pending:
+            self.pending = False
+            self.update_tags(self.base)
+            self.update_tags(self.unsorted)
     
     def store(self):
-        """ Store into file. """
+        """ Store into file. Returns False if failed to write, the 
+            bookmarks are kept modified in this case. """
         if self.modified:
-            self.backup() # ToDo configuration to enable/disable backup
+            snapshot = self.take_snapshot()
+            if not self.write_snapshot(snapshot):
+                return False
+        #self.reassign_all()
+        self.last_modified = next_generation()
+        self.modified = False
+        return True
+    
+    def take_snapshot(self):
+        """ Take state of the bookmarks to be written by write_snapshot. 
+            Children of containers are copied and pending changes 
+            are taken from the journal, items are shared. 
+            This should be called from the main thread. The lock to 
+            store is held until the snapshot is passed to write_snapshot, 
+            so snapshots are written in the order they are taken. """
+        self.store_lock.acquire()
+        try:
+            return self._take_snapshot()
+        except:
+            self.store_lock.release()
+            raise
+    
+    def _take_snapshot(self):
+        snapshot = BookmarksSnapshot(self.last_modified)
+        journal = self.journal
+        if self.database:
+            # only changed rows are taken
+            snapshot.changes = self.database.take_changes(self)
+        elif journal and self.USE_JOURNAL and \
+                not journal.needs_compaction(self.JOURNAL_LIMIT):
+            # only changes are appended
+            snapshot.entries = journal.take_entries()
+        else:
             obj = {
-                self.NAME_TAGS: self.tags, 
+                self.NAME_TAGS: dict(self.tags), 
                 self.NAME_BOOKMARKS: self.base, 
                 self.NAME_UNSORTED: self.unsorted
             }
-            s = self.__class__.dump(obj)
-            self._write_to_file(self.file_url, s)
-        #self.reassign_all()
-        self.last_modified = time.time()
-        self.modified = False
+            if journal:
+                if self._id > self.ID_LIMIT:
+                    self.renumber()
+                # the journal for older file is not applied
+                snapshot.serial = journal.serial + 1
+                obj[self.NAME_JOURNAL] = snapshot.serial
+                # ids are kept when the file is loaded, items inserted 
+                # later take ids not used in the file
+                obj[self.NAME_LAST_ID] = self._id
+                self.reserve_ids(self._id)
+                # written into the file
+                snapshot.entries = journal.take_entries()
+            snapshot.obj = obj
+            snapshot.children = {}
+            self._copy_children(self.base, snapshot.children)
+            self._copy_children(self.unsorted, snapshot.children)
+        return snapshot
+    
+    def renumber(self):
+        """ Reassign ids from 1 to all items. Ids grow while they are 
+            kept by the journal. This should be done only when whole 
+            file is written, the journal refers the old ids. """
+        self.load_pending()
+        self.reset_id()
+        self.clear_containers()
+        self.base.set_id(self.next_id())
+        for container in (self.base, self.unsorted):
+            self.assign_id(container)
+            self.register_item(container, True)
+        # entries of menus are keyed by ids
+        for container in list(self.containers.values()) + \
+                list(self.tags.values()):
+            container.touch()
+        self.last_modified = next_generation()
+    
+    def _copy_children(self, container, children):
+        if container is None:
+            return
+        pending = container.get_pending_children()
+        if pending is not None:
+            children[id(container)] = pending
+            return
+        _children = list(container.get_children())
+        children[id(container)] = _children
+        for child in _children:
+            if child.is_container():
+                self._copy_children(child, children)
+    
+    def write_snapshot(self, snapshot):
+        """ Write the snapshot taken by take_snapshot, returns True 
+            if written. This can be called from another thread. 
+            The lock taken by take_snapshot is released. """
+        try:
+            try:
+                state = self._write_snapshot(snapshot)
+            except Exception as e:
+                print(e)
+                traceback.print_exc()
+                state = False
+            if not state and snapshot.entries:
+                # written again with the next snapshot, no other 
+                # snapshot has been taken while the lock is held
+                self.journal.entries[0:0] = snapshot.entries
+            if not state and not snapshot.obj is None and self.journal:
+                # ids of later entries might not match to the file
+                self.journal.stale = True
+        finally:
+            self.store_lock.release()
+        return state
+    
+    def _write_snapshot(self, snapshot):
+        if not snapshot.changes is None:
+            self.backup() # ToDo configuration to enable/disable backup
+            self.database.write(snapshot.changes)
+            return True
+        journal = self.journal
+        if snapshot.obj is None:
+            try:
+                journal.flush(snapshot.entries)
+            except Exception as e:
+                print(e)
+                return False
+            return True
+        self.backup()
+        chunks = self.__class__.compress_chunks(
+            self.__class__.iterdump(snapshot.obj, snapshot.children), 
+            self.compression)
+        if not self._write_to_file(self.file_url, chunks):
+            return False
+        if journal:
+            journal.reset(snapshot.serial)
+        return True
     
     def backup(self):
         """ Copy current file to backup. """
@@ -235,9 +767,16 @@ class BookmarksManager(BookmarksManagerBase):
             
             if not backup_dir:
                 backup_dir = join_url(get_user_backup(self.ctx), self.BACKUP_DIR)
+            name = self.command.split(":")[-1]
+            if backup_dir.startswith("file:") and \
+                    self.file_url.startswith("file:"):
+                self._backup_snapshot(backup_dir, name)
+                return
             file_name = self.FILE_NAME % (
-                    time.strftime(self.DATE_FORMAT) + \
-                        "_" + self.command.split(":")[-1])
+                    time.strftime(self.DATE_FORMAT) + "_" + name)
+            if self.database:
+                file_name = os.path.splitext(file_name)[0] + \
+                    os.path.splitext(self.file_url)[1]
             copy_file(
                 self.ctx, 
                 self.file_url, 
@@ -246,19 +785,59 @@ class BookmarksManager(BookmarksManagerBase):
         except Exception as e:
             print(e)
     
-    def load(s):
-        """ Load JSON file as bookmarks from string. """
-        obj = None
+    def _backup_snapshot(self, backup_dir, name):
+        """ Add current file to the snapshots in the backup directory. 
+            The file is read here and stored in the background. """
+        from bookmarks import CONFIG_NODE_SETTINGS, \
+            NAME_BACKUP_COUNT, NAME_BACKUP_DAYS, NAME_BACKUP_DELTA
+        from bookmarks.tools import get_config
+        from bookmarks.backup import BookmarksBackup, BackupThread
+        prefix = os.path.splitext(self.FILE_NAME % name)[0]
+        path = os.path.join(uno.fileUrlToSystemPath(backup_dir), prefix)
+        if self.backups is None or self.backups.path != path:
+            self.backups = BookmarksBackup(path, prefix=prefix)
         try:
-            if s:
-                decoder = BookmarksJSONDecoder
-                obj = json.loads(
-                    s, 
-                    cls=decoder, 
-                    object_hook=decoder.obj_hook)
+            config = get_config(self.ctx, CONFIG_NODE_SETTINGS)
+            self.backups.max_count = config.getPropertyValue(NAME_BACKUP_COUNT)
+            self.backups.max_days = config.getPropertyValue(NAME_BACKUP_DAYS)
+            self.backups.use_delta = config.getPropertyValue(NAME_BACKUP_DELTA)
         except Exception as e:
             print(e)
-            traceback.print_exc()
+        if not self.has_location():
+            return # not yet stored
+        if self.database:
+            f = open(uno.fileUrlToSystemPath(self.file_url), "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        else:
+            # uncompressed to find difference from the previous one
+            data = self._read_bytes(self.file_url)[0]
+        BackupThread.get().push(self.backups, data)
+    
+    def load(s, lazy=False):
+        """ Load JSON file as bookmarks from string. 
+            If lazy, dicts are returned without decoding. """
+        obj = None
+        # decoded objects are kept alive by the result, collections 
+        # triggered by number of allocated objects would only walk them. 
+        # Children refer their container, these cycles are collected 
+        # after gc is enabled again if the result is dropped.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            try:
+                if s and lazy:
+                    obj = json.loads(s)
+                elif s:
+                    obj = json.loads(s, cls=BookmarksJSONDecoder)
+            except Exception as e:
+                print(e)
+                traceback.print_exc()
+        finally:
+            if gc_enabled:
+                gc.enable()
         return obj
     
     load = staticmethod(load)
@@ -280,6 +859,14 @@ class BookmarksManager(BookmarksManagerBase):
     
     dump = staticmethod(dump)
     
+    def iterdump(obj, children=None):
+        """ Store bookmarks as JSON, returns iterator of UTF-8 chunks. 
+            The result is the same as dump. If children is specified, 
+            children of containers are taken from it by their id. """
+        return BookmarksJSONStreamEncoder(children).iterencode(obj)
+    
+    iterdump = staticmethod(iterdump)
+    
     def command_to_path(ctx, command, fallback=False):
         """ Command to file path in config. """
         parts = command.split(":", 1)
@@ -363,22 +950,66 @@ class BookmarksManager(BookmarksManagerBase):
     pack = staticmethod(pack)
 
 
+class BookmarksSnapshot(object):
+    """ State of bookmarks to be written. """
+    
+    def __init__(self, generation):
+        self.generation = generation # last modified when taken
+        self.obj = None # to be written into the file
+        self.children = None # id of container: list of children
+        self.serial = None # of the journal for the file
+        self.entries = None # taken from the journal
+        self.changes = None # to be written into the database
+
+
 class BookmarksJSONBase(object):
     pass
 
 
+ITEM_TYPES = frozenset((
+    BookmarksDefs.TYPE_ITEM, 
+    BookmarksDefs.TYPE_SEPARATOR, 
+    BookmarksDefs.TYPE_CONTAINER
+))
+
+
 class BookmarksJSONDecoder(BookmarksJSONBase, json.JSONDecoder):
-    """ Customized decoder for bookmarks. """
+    """ Customized decoder for bookmarks. Bookmarks are created from 
+        objects having known type and tags are created according to 
+        the layout of the file after decoding. 
+    """
+    
+    def __init__(self, *args, **kwds):
+        kwds["object_hook"] = self.__class__.obj_hook
+        json.JSONDecoder.__init__(self, *args, **kwds)
+    
+    def decode(self, s, *args, **kwds):
+        obj = json.JSONDecoder.decode(self, s, *args, **kwds)
+        if isinstance(obj, dict):
+            self.__class__.decode_tags(obj)
+        return obj
+    
     def obj_hook(o):
-        try:
+        type = o.get(BookmarksDefs.NAME_TYPE, None)
+        if type in ITEM_TYPES:
             return BaseItem.create(o)
-        except:
-            try:
-                return TagContainer.create(o)
-            except:
-                return dict(o)
+        return o
     
     obj_hook = staticmethod(obj_hook)
+    
+    def decode_tags(obj):
+        """ Replace dicts in tags of obj with tag containers. """
+        tags = obj.get(BookmarksManager.NAME_TAGS, None)
+        if isinstance(tags, dict):
+            NAME_NAME = BookmarksDefs.NAME_NAME
+            for key, tag in list(tags.items()):
+                if isinstance(tag, dict) and NAME_NAME in tag:
+                    tags[key] = TagContainer.create(tag)
+                else:
+                    tags.pop(key)
+        return obj
+    
+    decode_tags = staticmethod(decode_tags)
 
 
 class BookmarksJSONEncoder(BookmarksJSONBase, json.JSONEncoder):
@@ -389,3 +1020,97 @@ class BookmarksJSONEncoder(BookmarksJSONBase, json.JSONEncoder):
         else:
             return json.JSONEncoder.default(self, o)
 
+
+
+class BookmarksJSONStreamEncoder(BookmarksJSONBase):
+    """ Encodes bookmarks into chunks of UTF-8 bytes without creating 
+        dicts for items. Output is the same as BookmarksJSONEncoder 
+        with ensure_ascii=False and sort_keys=True. 
+    """
+    
+    CHUNK_SIZE = 0x10000
+    
+    def __init__(self, children=None):
+        self.children = children
+        self.encoder = BookmarksJSONEncoder(
+                ensure_ascii=False, sort_keys=True)
+        self.encode_string = json.encoder.encode_basestring
+    
+    def iterencode(self, obj):
+        """ Returns iterator of UTF-8 chunks. """
+        chunk_size = self.CHUNK_SIZE
+        parts = []
+        size = 0
+        for part in self._iterencode(obj):
+            parts.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield "".join(parts).encode("utf-8")
+                parts = []
+                size = 0
+        if parts:
+            yield "".join(parts).encode("utf-8")
+    
+    def _value(self, o):
+        if isinstance(o, string_types):
+            return self.encode_string(o)
+        return self.encoder.encode(o)
+    
+    def _iterencode(self, o):
+        value = self._value
+        if isinstance(o, Item):
+            yield '{"command": %s, "description": %s, "id": %s, ' \
+                '"name": %s, "parent": %s, "tags": [%s], "type": "item"}' % (
+                    value(o.command), value(o.description), value(o.id), 
+                    value(o.name), value(o.parent), 
+                    ", ".join([value(tag) for tag in o.tags]))
+        elif isinstance(o, Container):
+            yield '{"children": '
+            if self.children is not None:
+                children = self.children[id(o)]
+            else:
+                children = o.get_pending_children()
+                if children is None:
+                    children = o.get_children()
+            for part in self._iterencode(children):
+                yield part
+            yield ', "description": %s, "id": %s, "name": %s, ' \
+                '"parent": %s, "type": "container"}' % (
+                    value(o.description), value(o.id), value(o.name), 
+                    value(o.parent))
+        elif isinstance(o, Separator):
+            yield '{"id": %s, "parent": %s, "type": "separator"}' % (
+                value(o.id), value(o.parent))
+        elif isinstance(o, TagContainer):
+            yield '{"description": %s, "name": %s}' % (
+                value(o.description), value(o.name))
+        elif isinstance(o, (list, tuple)):
+            if not o:
+                yield "[]"
+                return
+            separator = "["
+            for child in o:
+                yield separator
+                for part in self._iterencode(child):
+                    yield part
+                separator = ", "
+            yield "]"
+        elif isinstance(o, dict):
+            keys = list(o.keys())
+            if not all([isinstance(key, string_types) for key in keys]):
+                for part in self.encoder.iterencode(o):
+                    yield part
+                return
+            if not keys:
+                yield "{}"
+                return
+            keys.sort()
+            separator = "{"
+            for key in keys:
+                yield separator + value(key) + ": "
+                for part in self._iterencode(o[key]):
+                    yield part
+                separator = ", "
+            yield "}"
+        else:
+            yield value(o)
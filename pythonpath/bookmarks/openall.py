@@ -0,0 +1,207 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+import threading
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from bookmarks.tools import MainThreadCallback, show_message
+
+
+class OpenAllScheduler(object):
+    """ Opens entries of "Open All" without blocking the office.
+    
+        External programs are started in worker threads, number of them
+        is limited. Documents are dispatched one by one in the main
+        thread, each of them after the interval to process events.
+        Progress is shown in the status indicator of the frame and 
+        errors are shown in a message after all entries are opened.
+        Selecting "Open All" again while opening cancels remaining 
+        entries, see cancel_running.
+    """
+    
+    # number of threads to start external programs
+    MAX_WORKERS = 4
+    # seconds between dispatches of documents
+    INTERVAL = 0.2
+    # seconds to wait a document to be opened in the main thread, 
+    # remaining entries are cancelled after this
+    DOCUMENT_TIMEOUT = 60
+    
+    Running = [] # schedulers not yet finished
+    
+    def start(ctx, frame, tasks, title=""):
+        """ Start to run tasks on the frame. tasks is list of tuple of
+            function, argument and flag to run in worker thread. """
+        klass = OpenAllScheduler
+        scheduler = klass(ctx, frame, tasks, title)
+        klass.Running.append(scheduler)
+        scheduler.run()
+        return scheduler
+    
+    start = staticmethod(start)
+    
+    def cancel_running(frame):
+        """ Cancel tasks running on the frame, returns True if cancelled. """
+        cancelled = False
+        for running in OpenAllScheduler.Running:
+            if running.frame == frame and not running.cancelled:
+                running.cancel()
+                cancelled = True
+        return cancelled
+    
+    cancel_running = staticmethod(cancel_running)
+    
+    def __init__(self, ctx, frame, tasks, title=""):
+        self.ctx = ctx
+        self.frame = frame
+        self.title = title
+        self.documents = [(fn, arg) for fn, arg, external in tasks
+                            if not external]
+        self.externals = queue.Queue()
+        for fn, arg, external in tasks:
+            if external:
+                self.externals.put((fn, arg))
+        self.total = len(tasks)
+        self.done = 0
+        self.cancelled = False
+        self.finished = False
+        self.lock = threading.Lock()
+        self.indicator = None
+        self.threads = []
+        self.active = 0 # number of running threads
+        self.errors = [] # messages of failed tasks
+        self.document_callback = MainThreadCallback(ctx, self._open_document)
+        self.progress_callback = MainThreadCallback(ctx, self._update_progress)
+    
+    def cancel(self):
+        """ Stop to open remaining entries. """
+        self.cancelled = True
+    
+    def run(self):
+        if not self.total:
+            self._update_progress()
+            return
+        try:
+            self.indicator = self.frame.createStatusIndicator()
+            self.indicator.start(self.title, self.total)
+        except:
+            self.indicator = None
+        targets = [self._run_externals] * \
+            min(self.MAX_WORKERS, self.externals.qsize())
+        if self.documents:
+            targets.append(self._run_documents)
+        self.active = len(targets)
+        for target in targets:
+            thread = threading.Thread(target=self._run_thread, args=(target,))
+            thread.daemon = True
+            self.threads.append(thread)
+        for thread in self.threads:
+            thread.start()
+    
+    def _run_thread(self, target):
+        try:
+            target()
+        finally:
+            with self.lock:
+                self.active -= 1
+            self.progress_callback.post()
+    
+    def _task_done(self):
+        with self.lock:
+            self.done += 1
+        self.progress_callback.post()
+    
+    def _run_externals(self):
+        """ Start external programs in worker thread. """
+        while not self.cancelled:
+            try:
+                fn, arg = self.externals.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(arg)
+            except Exception as e:
+                self._add_error(e)
+            self._task_done()
+    
+    def _run_documents(self):
+        """ Request to dispatch each document to the main thread and
+            wait it to be finished. """
+        self.document_done = threading.Event()
+        for fn, arg in self.documents:
+            if self.cancelled:
+                break
+            self.document_done.clear()
+            self.current = (fn, arg)
+            self.document_callback.post()
+            if not self.document_done.wait(self.DOCUMENT_TIMEOUT):
+                # main thread is busy, not opened later
+                self.cancel()
+                break
+            self._task_done()
+            time.sleep(self.INTERVAL)
+    
+    def _open_document(self):
+        """ Called in the main thread. """
+        try:
+            if not self.cancelled:
+                fn, arg = self.current
+                fn(arg)
+        except Exception as e:
+            self._add_error(e)
+            traceback.print_exc()
+        self.document_done.set()
+    
+    def _add_error(self, e):
+        print(e)
+        with self.lock:
+            self.errors.append(str(e))
+    
+    def _update_progress(self):
+        """ Called in the main thread. """
+        if self.finished:
+            return
+        with self.lock:
+            done = self.done
+            active = self.active
+        if self.indicator:
+            try:
+                self.indicator.setValue(done)
+            except:
+                pass
+        if done >= self.total or active <= 0:
+            self.finished = True
+            if self.indicator:
+                try:
+                    self.indicator.end()
+                except:
+                    pass
+            if self in OpenAllScheduler.Running:
+                OpenAllScheduler.Running.remove(self)
+            if self.errors:
+                self._show_errors()
+    
+    def _show_errors(self):
+        """ Called in the main thread. """
+        try:
+            show_message(self.ctx, self.frame, 
+                "\n".join(self.errors), self.title, "warningbox")
+        except Exception as e:
+            print(e)
@@ -51,5 +51,5 @@ class TagPopup(bookmarks.bookmarks_pmc.BookmarksPopupBase):
     # XPopupMenuController
     def updatePopupMenu(self):
         if self.manager.is_modified_since(self.last_checked):
-            self.prepare_menu(clear=True)
+            self.update_menu()
 
@@ -14,9 +14,11 @@
 
 import uno
 import unohelper
+import traceback
 from com.sun.star.beans import PropertyValue, StringPair
 from com.sun.star.lang import Locale
 from com.sun.star.task import XInteractionHandler
+from com.sun.star.awt import XCallback
 
 
 def create_service(ctx, name, args=None):
@@ -438,3 +440,29 @@ class FileFilterManager(object):
             filter_groups.append(("other", modules["other"]))
         self.filter_groups = filter_groups
 
+
+class MainThreadCallback(unohelper.Base, XCallback):
+    """ Calls the function in the main thread. """
+    
+    def __init__(self, ctx, function):
+        self.function = function
+        self.async_callback = None
+        try:
+            self.async_callback = ctx.getServiceManager().\
+                createInstanceWithContext("com.sun.star.awt.AsyncCallback", ctx)
+        except:
+            pass
+    
+    def post(self):
+        if self.async_callback is None:
+            self.notify(None)
+        else:
+            self.async_callback.addCallback(self, None)
+    
+    # XCallback
+    def notify(self, data):
+        try:
+            self.function()
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
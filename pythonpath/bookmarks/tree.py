@@ -126,6 +126,13 @@ class CustomTreeNode(unohelper.Base, XTreeNode, XMaterialHolder):
         node.set_parent(self)
         self.data_model.inserted((node, ), self)
     
+    def insert_children(self, index, nodes):
+        """ Insert nodes starting at index. """
+        self.children[index:index] = nodes
+        for node in nodes:
+            node.set_parent(self)
+        self.data_model.inserted(tuple(nodes), self)
+    
     def remove_child_at(self, index):
         """ Remove specific node at index. """
         try:
@@ -142,6 +149,13 @@ class CustomTreeNode(unohelper.Base, XTreeNode, XMaterialHolder):
         except:
             pass
     
+    def remove_children(self, nodes):
+        """ Remove child nodes. """
+        removing = set(nodes)
+        self.children[:] = [node for node in self.children 
+                                if not node in removing]
+        self.data_model.removed(tuple(nodes), self)
+    
     def get_data(self):
         """ Get data value. """
         return self.data
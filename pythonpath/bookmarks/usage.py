@@ -0,0 +1,338 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import json
+import math
+import time
+import heapq
+import tempfile
+
+from bookmarks.bookmark import BaseContainer, next_generation
+
+
+class UsageContainer(BaseContainer):
+    """ Keeps frequently used items to be shown in popup menu.
+        Items are not owned by this container. """
+    
+    def __init__(self, name=""):
+        BaseContainer.__init__(self)
+        self.name = name
+        self.built = 0 # generation of the usage when built
+        self.checked = 0 # generation of the bookmarks when built
+        self.count = 0
+    
+    def __repr__(self):
+        return "<Usage %s>" % self.name
+    
+    def get_name(self):
+        return self.name
+    
+    def get_description(self):
+        return ""
+
+
+class BookmarksUsage(object):
+    """ Counts executions of items of a bookmarks.
+        
+        Records are kept by the command of items, so they are not lost 
+        when ids of items are changed. Id of the last executed item is 
+        kept to find the item, the bookmarks are searched only when the 
+        item having the id does not have the command anymore.
+        
+        Each record has frecency key, log of the score decayed with the
+        half-life, shifted to be independent of the current time.
+        Order of keys is the order of scores at any time, so keys are
+        kept in a heap and stale entries of the heap are dropped when
+        they are found. Records are written into the file next to the
+        bookmarks file after some executions.
+    """
+    
+    EXTENSION = ".usage"
+    VERSION = 2
+    
+    # seconds until the score is halved
+    HALF_LIFE = 14 * 86400
+    RATE = math.log(2) / HALF_LIFE
+    
+    # records to be written at once
+    FLUSH_COUNT = 10
+    # seconds after the last writing to write at the next record
+    FLUSH_INTERVAL = 60
+    # number of records kept in the file
+    MAX_ENTRIES = 1000
+    
+    Usages = {} # manager: BookmarksUsage
+    
+    def get(manager):
+        """ Returns usage for the manager. """
+        klass = BookmarksUsage
+        usage = klass.Usages.get(manager, None)
+        if usage is None:
+            usage = klass(manager, klass.path_for(manager.file_url))
+            klass.Usages[manager] = usage
+        return usage
+    
+    get = staticmethod(get)
+    
+    def release(manager):
+        """ Write records of the manager and forget it. """
+        usage = BookmarksUsage.Usages.pop(manager, None)
+        if usage is not None:
+            try:
+                usage.flush()
+            except Exception as e:
+                print(e)
+            usage.manager = None
+            usage.container = None
+    
+    release = staticmethod(release)
+    
+    def flush_all():
+        """ Write records of all bookmarks not yet written. """
+        for usage in BookmarksUsage.Usages.values():
+            try:
+                usage.flush()
+            except Exception as e:
+                print(e)
+    
+    flush_all = staticmethod(flush_all)
+    
+    def path_for(file_url):
+        """ Returns path of the usage file for local file,
+            otherwise None. """
+        if not file_url or not file_url.startswith("file:"):
+            return None
+        import uno
+        return uno.fileUrlToSystemPath(file_url) + BookmarksUsage.EXTENSION
+    
+    path_for = staticmethod(path_for)
+    
+    def __init__(self, manager, path):
+        self.manager = manager
+        self.path = path
+        self.entries = None # command: [key, count, last used, id]
+        self.heap = [] # (-key, command)
+        self.pending = 0 # records not yet written
+        self.last_flush = time.time()
+        self.generation = next_generation()
+        self.container = None
+    
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if not self.path:
+            return
+        try:
+            f = open(self.path, "rb")
+            try:
+                obj = json.loads(f.read().decode("utf-8"))
+            finally:
+                f.close()
+            version = obj.get("version")
+            if version == self.VERSION:
+                for command, key, count, last_used, id in obj["items"]:
+                    self.entries[command] = [key, count, last_used, id]
+            elif version == 1:
+                # kept by id
+                for id, key, count, last_used, command in obj["items"]:
+                    entry = self.entries.get(command, None)
+                    if entry is None or entry[0] < key:
+                        self.entries[command] = [key, count, last_used, id]
+        except IOError:
+            pass
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(e)
+            self.entries = {}
+        self._compact()
+    
+    def score(self, key, now=None):
+        """ Returns score of the key at the time. """
+        if now is None:
+            now = time.time()
+        return math.exp(key - now * self.RATE)
+    
+    def get_generation(self):
+        """ Returns generation updated by records. """
+        return self.generation
+    
+    def get_count(self, item):
+        """ Returns number of executions of the command of the item. """
+        self._load()
+        entry = self.entries.get(item.get_command(), None)
+        return entry and entry[1] or 0
+    
+    def record(self, item, now=None):
+        """ Count an execution of the item. """
+        if now is None:
+            now = time.time()
+        self._load()
+        command = item.get_command()
+        base = now * self.RATE
+        entry = self.entries.get(command, None)
+        if entry is None:
+            key = base
+            entry = [key, 1, now, item.get_id()]
+            self.entries[command] = entry
+        else:
+            # log(score * decay + 1) shifted by the time
+            key = base + math.log1p(math.exp(entry[0] - base))
+            entry[0] = key
+            entry[1] += 1
+            entry[2] = now
+            entry[3] = item.get_id()
+        heapq.heappush(self.heap, (-key, command))
+        if len(self.heap) > 2 * len(self.entries) + 16:
+            self._compact()
+        self.generation = next_generation()
+        self.pending += 1
+        if self.pending >= self.FLUSH_COUNT or \
+                now - self.last_flush >= self.FLUSH_INTERVAL:
+            try:
+                self.flush()
+            except Exception as e:
+                print(e)
+    
+    def forget(self, command):
+        """ Remove record of the command, entry of the heap is dropped
+            when it is found. """
+        self._load()
+        if self.entries.pop(command, None) is not None:
+            self.generation = next_generation()
+            self.pending += 1
+    
+    def _compact(self):
+        self.heap = [(-entry[0], command) 
+                        for command, entry in self.entries.items()]
+        heapq.heapify(self.heap)
+    
+    def top(self, n):
+        """ Returns list of (command, entry) of the most used n records 
+            in descending order. """
+        self._load()
+        heap = self.heap
+        entries = self.entries
+        found = []
+        seen = set()
+        while heap and len(found) < n:
+            negative_key, command = heapq.heappop(heap)
+            entry = entries.get(command, None)
+            if entry is None or entry[0] != -negative_key or \
+                    command in seen:
+                # stale
+                continue
+            seen.add(command)
+            found.append((command, entry))
+        for command, entry in found:
+            heapq.heappush(heap, (-entry[0], command))
+        return found
+    
+    def top_items(self, n):
+        """ Returns items of the most used n records of the bookmarks. """
+        get_item = self.manager.get_item
+        while True:
+            items = []
+            missing = {}
+            for command, entry in self.top(n):
+                item = get_item(entry[3])
+                if item is not None and item.is_item() and \
+                        item.get_command() == command:
+                    items.append(item)
+                else:
+                    missing[command] = entry
+            if not missing:
+                return items
+            self._relocate(missing)
+    
+    def _relocate(self, missing):
+        """ Find items by commands of the records, records of commands 
+            not found are forgotten. """
+        stack = [self.manager.base, self.manager.unsorted]
+        while stack and missing:
+            container = stack.pop()
+            if container is None:
+                continue
+            for child in container.get_children():
+                if child.is_item():
+                    entry = missing.pop(child.get_command(), None)
+                    if entry is not None:
+                        entry[3] = child.get_id()
+                        self.pending += 1
+                elif child.is_container():
+                    stack.append(child)
+        for command in missing:
+            self.forget(command)
+    
+    def get_container(self, n, name=""):
+        """ Returns container of the most used n items, which is
+            rebuilt after records or changes of the bookmarks. """
+        container = self.container
+        if container is None:
+            container = UsageContainer(name)
+            self.container = container
+        if container.built != self.generation or container.count != n or \
+                self.manager.is_modified_since(container.checked):
+            container.checked = self.manager.get_last_modified()
+            container.children = self.top_items(n)
+            container.built = self.generation
+            container.count = n
+            container.touch()
+        return container
+    
+    def flush(self):
+        """ Write records into the file if not yet written. """
+        if not self.pending or self.entries is None:
+            return
+        self.pending = 0
+        self.last_flush = time.time()
+        if not self.path:
+            return
+        entries = self.entries
+        commands = list(entries.keys())
+        if len(commands) > self.MAX_ENTRIES:
+            commands = heapq.nlargest(self.MAX_ENTRIES, commands,
+                                    key=lambda command: entries[command][0])
+            for command in set(entries.keys()).difference(commands):
+                entries.pop(command)
+            self._compact()
+        obj = {
+            "version": self.VERSION,
+            "items": [[command] + entries[command] 
+                        for command in sorted(commands)],
+        }
+        self._write(json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+    
+    def _write(self, data):
+        """ Replace the file atomically. """
+        dir_path = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp", dir=dir_path)
+        try:
+            f = os.fdopen(fd, "wb")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            if hasattr(os, "replace"):
+                os.replace(tmp_path, self.path)
+            else:
+                if os.name == "nt" and os.path.exists(self.path):
+                    os.remove(self.path)
+                os.rename(tmp_path, self.path)
+        except:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
@@ -0,0 +1,67 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+def create(ctx, *args):
+    return UsagePopup(ctx, args)
+
+import bookmarks.bookmarks_pmc
+
+class UsagePopup(bookmarks.bookmarks_pmc.BookmarksPopupBase):
+    """ Shows frequently used items in popup menu. """
+    
+    from bookmarks import USAGE_POPUP_IMPLE_NAME as IMPLE_NAME, \
+        SERVICE_NAMES
+    
+    DEFAULT_ITEM_COUNT = 10
+    
+    def __init__(self, ctx, args):
+        bookmarks.bookmarks_pmc.BookmarksPopupBase.__init__(self, ctx, args)
+        self.controller = None
+        self.usage = None
+        self.item_count = self.load_item_count()
+        self.usage_checked = 0
+        self.initialize(args)
+    
+    def load_item_count(self):
+        """ Read number of items from the configuration. """
+        from bookmarks import CONFIG_NODE_SETTINGS, NAME_USAGE_ITEM_COUNT
+        from bookmarks.tools import get_config_value
+        try:
+            return get_config_value(
+                self.ctx, CONFIG_NODE_SETTINGS, NAME_USAGE_ITEM_COUNT)
+        except:
+            return self.DEFAULT_ITEM_COUNT
+    
+    def set_controller(self, controller):
+        from bookmarks.usage import BookmarksUsage
+        self.controller = controller
+        self.manager = controller.manager
+        self.commands = controller.commands
+        self.usage = BookmarksUsage.get(self.manager)
+        self.update_last_checked()
+    
+    def update_last_checked(self):
+        bookmarks.bookmarks_pmc.BookmarksPopupBase.update_last_checked(self)
+        if self.usage:
+            self.usage_checked = self.usage.get_generation()
+    
+    def get_container(self):
+        if self.usage:
+            return self.usage.get_container(self.item_count)
+    
+    # XPopupMenuController
+    def updatePopupMenu(self):
+        if self.usage and (self.manager.is_modified_since(self.last_checked) or 
+                self.usage_checked != self.usage.get_generation()):
+            self.update_menu()
@@ -14,6 +14,8 @@ imples = {
         (bookmarks.SERVICE_NAMES, "bookmarks.directory_pmc.create"), 
     bookmarks.TAG_POPUP_IMPLE_NAME: 
         (bookmarks.SERVICE_NAMES, "bookmarks.tag_pmc.create"), 
+    bookmarks.USAGE_POPUP_IMPLE_NAME: 
+        (bookmarks.SERVICE_NAMES, "bookmarks.usage_pmc.create"), 
 }
 
 
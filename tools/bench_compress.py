@@ -0,0 +1,63 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+""" Size and time to store and open compressed bookmarks files.
+
+    Bookmarks are stored into plain, gzip and zlib files, which are
+    chosen by the extension of the file, and they are opened again.
+
+    python tools/bench_compress.py [number of items]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+import benchenv
+
+
+def main():
+    from bookmarks.manager import BookmarksManager
+    count = 50000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    BookmarksManager.LAZY_LOAD = False
+    tags, base, unsorted = benchenv.build_tree(count)
+    dir_path = tempfile.mkdtemp()
+    try:
+        print("%d items" % count)
+        print("%-14s %10s %8s %8s" % ("file", "bytes", "store", "open"))
+        for name in ("bookmarks.json", "bookmarks.json.gz",
+                    "bookmarks.json.zlib"):
+            path = os.path.join(dir_path, name)
+            manager = benchenv.new_manager("file://" + path)
+            manager.tags = tags
+            manager.base = base
+            manager.unsorted = unsorted
+            def store():
+                manager.modified = True
+                manager.store()
+            store_seconds = benchenv.best_of(store)
+            manager = benchenv.new_manager("file://" + path)
+            open_seconds = benchenv.best_of(
+                lambda: manager.open(fallback=False))
+            print("%-14s %10d %8.3f %8.3f" % (name[len("bookmarks"):],
+                os.path.getsize(path), store_seconds, open_seconds))
+    finally:
+        shutil.rmtree(dir_path)
+
+
+if __name__ == "__main__":
+    main()
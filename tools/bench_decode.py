@@ -0,0 +1,83 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+""" Time to decode bookmarks file of 50k items.
+
+    The decoder dispatching on the type of objects is compared with the
+    hook which tried to create item and tag from each object and caught
+    exceptions, as it was before. Opening the file is measured in both
+    eager and lazy way with time of each phase.
+
+    python tools/bench_decode.py [number of items]
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+import benchenv
+
+
+def hook_with_exceptions(o):
+    """ Object hook before the decoder knows the layout. """
+    from bookmarks.bookmark import BaseItem, TagContainer
+    try:
+        return BaseItem.create(o)
+    except:
+        try:
+            return TagContainer.create(o)
+        except:
+            return dict(o)
+
+
+def main():
+    from bookmarks.manager import BookmarksManager
+    count = 50000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    tags, base, unsorted = benchenv.build_tree(count)
+    data = BookmarksManager.dump(BookmarksManager.pack(tags, base, unsorted))
+    s = data.decode("utf-8")
+    print("%d items, %.1f MB" % (count, len(data) / 1048576.0))
+    exceptions = benchenv.best_of(
+        lambda: json.loads(s, object_hook=hook_with_exceptions))
+    dispatch = benchenv.best_of(lambda: BookmarksManager.load(s))
+    lazy = benchenv.best_of(lambda: BookmarksManager.load(s, True))
+    print("%-24s %8.3f s" % ("hook with exceptions", exceptions))
+    print("%-24s %8.3f s  %.1fx" % ("decoder", dispatch, exceptions / dispatch))
+    print("%-24s %8.3f s" % ("dicts for lazy loading", lazy))
+    dir_path = tempfile.mkdtemp()
+    try:
+        path = os.path.join(dir_path, "bookmarks.json")
+        f = open(path, "wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        for lazy_load in (False, True):
+            BookmarksManager.LAZY_LOAD = lazy_load
+            manager = benchenv.new_manager("file://" + path)
+            seconds = benchenv.best_of(lambda: manager.open(fallback=False))
+            print("%-24s %8.3f s  (%s)" % (
+                lazy_load and "open lazily" or "open", seconds,
+                ", ".join(["%s %.3f" % phase
+                            for phase in manager.load_phases])))
+    finally:
+        shutil.rmtree(dir_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+""" Time to find positions of children in large folders.
+
+    The position map of the container is compared with list.index,
+    which scanned the children as it was before. Lookups between
+    changes are dict lookups. The first lookup after a change scans
+    children after the changed position and the next one updates the
+    map from there, so a lookup after each insertion in the middle
+    still takes linear time, while insertions at the end or batches 
+    of changes are cheap.
+
+    python tools/bench_index.py [number of children ...]
+"""
+
+import sys
+import random
+
+import benchenv
+
+# number of changes and lookups for each case
+COUNT = 1000
+
+
+def new_container(manager, size):
+    from bookmarks.bookmark import Container, Item
+    container = Container("Folder")
+    container.children = [Item("Item %d" % i, "", "http://example.com/%d" % i)
+                            for i in range(size)]
+    manager.base = container
+    manager.unsorted = Container("Unsorted Bookmarks")
+    manager.reassign_all()
+    return container
+
+
+def new_item():
+    from bookmarks.bookmark import Item
+    return Item("New item", "", "http://example.com/new")
+
+
+def lookups(manager, size, indexed):
+    container = new_container(manager, size)
+    children = list(container.get_children())
+    targets = [random.choice(children) for i in range(COUNT)]
+    def run():
+        if indexed:
+            for item in targets:
+                container.get_child_index(item)
+        else:
+            for item in targets:
+                children.index(item)
+    return benchenv.best_of(run)
+
+
+def changes(manager, size, indexed, middle, batch):
+    def run():
+        container = new_container(manager, size)
+        children = container.get_children()
+        last = children[-1]
+        for i in range(COUNT):
+            if middle:
+                position = len(children) // 2
+            else:
+                position = len(children)
+            container.insert_child(manager, position, new_item())
+            if not batch:
+                if indexed:
+                    container.get_child_index(last)
+                else:
+                    children.index(last)
+        if batch:
+            for item in children[-COUNT:]:
+                if indexed:
+                    container.get_child_index(item)
+                else:
+                    children.index(item)
+    return benchenv.best_of(run)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+    random.seed(0)
+    manager = benchenv.new_manager("")
+    cases = (
+        ("lookups", lambda size, indexed: lookups(manager, size, indexed)),
+        ("append, lookup", lambda size, indexed:
+            changes(manager, size, indexed, False, False)),
+        ("middle, lookup", lambda size, indexed:
+            changes(manager, size, indexed, True, False)),
+        ("middle batch", lambda size, indexed:
+            changes(manager, size, indexed, True, True)),
+    )
+    print("seconds for %d operations" % COUNT)
+    print("%-16s %8s %10s %10s" % ("case", "children", "index", "scan"))
+    for name, case in cases:
+        for size in sizes:
+            print("%-16s %8d %10.4f %10.4f" % (
+                name, size, case(size, True), case(size, False)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+""" Memory used by items of bookmarks.
+
+    Items having __slots__ and shared tuples of tags are compared with
+    items of the baseline commit, which are read from the git repository.
+    They have instance dict, empty dict of options and list of tags 
+    for each item.
+
+    python tools/bench_memory.py [number of items]
+"""
+
+import os
+import sys
+import gc
+import types
+import subprocess
+
+import benchenv
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# commit and module of items before __slots__
+BASELINE = "e29adad"
+BASELINE_PATH = "pythonpath/bookmarks/bookmark.py"
+
+
+def load_baseline():
+    """ Returns bookmark module of the baseline commit. """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    source = subprocess.check_output(
+        ["git", "show", "%s:%s" % (BASELINE, BASELINE_PATH)], cwd=root)
+    module = types.ModuleType("baseline_bookmark")
+    module.__file__ = BASELINE_PATH
+    exec(compile(source, BASELINE_PATH, "exec"), module.__dict__)
+    return module
+
+
+def build(count, Container, Item):
+    base = Container("Bookmarks")
+    folder = None
+    for i in range(count):
+        if i % 100 == 0:
+            folder = Container("Folder %d" % (i // 100))
+            base.children.append(folder)
+        # each item has its own list of tags after decoding JSON
+        folder.children.append(Item("Document %d" % i, "",
+            "http://example.com/%d" % i, ["tag%d" % (i % 20)]))
+    return base
+
+
+def measure(count, Container, Item):
+    """ Returns bytes allocated to keep the tree. """
+    gc.collect()
+    tracemalloc.start()
+    base = build(count, Container, Item)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del base
+    return size
+
+
+def main():
+    if tracemalloc is None:
+        print("tracemalloc is required")
+        return
+    from bookmarks.bookmark import Container, Item
+    count = 100000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    baseline = load_baseline()
+    before = measure(count, baseline.Container, baseline.Item)
+    after = measure(count, Container, Item)
+    print("%d items" % count)
+    print("%s items: %7.1f MB  %4d bytes/item" % (BASELINE,
+        before / 1048576.0, before // count))
+    print("slotted items: %7.1f MB  %4d bytes/item" %
+        (after / 1048576.0, after // count))
+    print("saved:         %7.1f MB  (%.0f%%)" %
+        ((before - after) / 1048576.0, 100.0 * (before - after) / before))
+
+
+if __name__ == "__main__":
+    main()
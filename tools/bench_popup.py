@@ -0,0 +1,218 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+""" Calls to popup menus of UNO for each refresh of the bookmarks menu.
+
+    All sub popups of the menu are filled, then the bookmarks are edited
+    at random. After each edit, the menu is refreshed by updating
+    changed entries and by filling it again from cleared state as it
+    was before. Calls to the popup menus are counted in both ways, 
+    for the cleared menu, calls to fill the top menu only and calls 
+    to fill all sub popups shown again are counted.
+
+    python tools/bench_popup.py [number of edits]
+"""
+
+import sys
+import random
+
+import benchenv
+
+
+class PopupMenu(object):
+    """ Popup menu counting calls to it. """
+    
+    calls = 0
+    
+    def __init__(self):
+        self.ids = []
+        self.subs = {}
+    
+    def _call(self):
+        PopupMenu.calls += 1
+    
+    def insertItem(self, id, text, style, position):
+        self._call()
+        self.ids.insert(position, id)
+    
+    def insertSeparator(self, position):
+        self._call()
+        self.ids.insert(position, 0)
+    
+    def removeItem(self, position, count):
+        self._call()
+        del self.ids[position:position + count]
+    
+    def setCommand(self, id, command):
+        self._call()
+    
+    def setItemText(self, id, text):
+        self._call()
+    
+    def setTipHelpText(self, id, text):
+        self._call()
+    
+    def setPopupMenu(self, id, popup):
+        self._call()
+        self.subs[id] = popup
+    
+    def getPopupMenu(self, id):
+        return self.subs.get(id, None)
+    
+    def getItemCount(self):
+        return len(self.ids)
+    
+    def clear(self):
+        self._call()
+        self.ids = []
+        self.subs = {}
+    
+    def addMenuListener(self, listener):
+        pass
+    
+    def removeMenuListener(self, listener):
+        pass
+
+
+class Resource(object):
+    """ Returns names as they are. """
+    
+    def get(self, name, default=None):
+        return name
+
+
+def new_popup_class():
+    import bookmarks.resource
+    from bookmarks.bookmarks_pmc import BookmarksPopupBase
+    bookmarks.resource.CurrentStringResource.get = \
+        staticmethod(lambda ctx: Resource())
+    BookmarksPopupBase.POPUP_NAMES = {}
+    BookmarksPopupBase.PAGE_SIZE = 0
+    
+    class Popup(BookmarksPopupBase):
+        """ Bookmarks menu showing the container. """
+        
+        def __init__(self, manager, container):
+            BookmarksPopupBase.__init__(self, None, ())
+            self.manager = manager
+            self.container = container
+            self.menu = PopupMenu()
+        
+        def get_container(self):
+            return self.container
+        
+        def create_sub_popup(self):
+            return PopupMenu()
+        
+        def fill_all(self):
+            """ Fill sub popups as they are shown. """
+            self._fill_subs(self.menu)
+        
+        def _fill_subs(self, popup):
+            for id, sub in list(popup.subs.items()):
+                container = self.sub_popups.get(id, None)
+                if container is not None and container.is_container():
+                    if not sub.getItemCount():
+                        self.fill_popup(sub, container)
+                    self._fill_subs(sub)
+    
+    return Popup
+
+
+def build(manager):
+    from bookmarks.bookmark import Container, Item, Separator
+    base = Container("Bookmarks")
+    def fill(container, depth):
+        for i in range(30 if depth else 300):
+            if depth < 2 and i % 6 == 0:
+                folder = Container("Folder %d" % i)
+                container.children.append(folder)
+                fill(folder, depth + 1)
+            elif i % 10 == 9:
+                container.children.append(Separator())
+            else:
+                container.children.append(
+                    Item("Item %d" % i, "", "http://example.com/%d" % i))
+    fill(base, 0)
+    manager.base = base
+    manager.unsorted = Container("Unsorted Bookmarks")
+    manager.reassign_all()
+    return base
+
+
+def containers(container):
+    found = [container]
+    for child in container.get_children():
+        if child.is_container():
+            found.extend(containers(child))
+    return found
+
+
+def edit(manager, base):
+    """ Change the bookmarks at random. """
+    from bookmarks.bookmark import Item
+    container = random.choice(containers(base))
+    children = container.get_children()
+    op = random.random()
+    if op < 0.4 and children:
+        child = random.choice(children)
+        if child.is_item():
+            child.set_name(child.get_name() + " (edited)")
+            manager.touch_item(child)
+            return
+    if op < 0.7 or not children:
+        item = Item("New item", "", "http://example.com/new")
+        container.insert_child(manager, random.randint(0, len(children)), item)
+    else:
+        container.remove_child_at(manager, random.randrange(len(children)))
+
+
+def main():
+    count = 50
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    random.seed(0)
+    Popup = new_popup_class()
+    manager = benchenv.new_manager("")
+    base = build(manager)
+    popup = Popup(manager, base)
+    popup.prepare_menu()
+    popup.fill_all()
+    updated = 0
+    rebuilt = 0
+    rebuilt_all = 0
+    same = True
+    for i in range(count):
+        edit(manager, base)
+        PopupMenu.calls = 0
+        popup.update_menu()
+        popup.fill_all()
+        updated += PopupMenu.calls
+        full = Popup(manager, base)
+        PopupMenu.calls = 0
+        full.prepare_menu(clear=True)
+        rebuilt += PopupMenu.calls
+        full.fill_all()
+        rebuilt_all += PopupMenu.calls
+        same = same and popup.menu.ids == full.menu.ids
+    print("%d edits, %d containers" % (count, len(containers(base))))
+    print("calls per refresh")
+    print("  update changed entries:      %8.1f" % (updated / float(count)))
+    print("  fill cleared menu:           %8.1f" % (rebuilt / float(count)))
+    print("  fill cleared menu and subs:  %8.1f" % (rebuilt_all / float(count)))
+    print("updated menu is same as filled one: %s" % same)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+""" Time to read bookmarks files of some sizes.
+
+    Local files and files read through SimpleFileAccess are read by the
+    reader of the manager. The reader which concatenated bytes of each
+    chunk, as it was before, is measured for small files only, its time
+    grows with the square of the size.
+
+    python tools/bench_read.py [size in MB ...]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+import benchenv
+
+# the concatenating reader takes too long for larger files
+CONCAT_LIMIT = 20
+
+
+def read_concat(file_url):
+    """ Reader before chunks are collected into buffer. """
+    sfa = benchenv.FileAccess()
+    io = sfa.openFileRead(file_url)
+    text = bytes()
+    while True:
+        n, data = io.readBytes(None, 0xffff)
+        text += data.value
+        if n < 0xffff:
+            break
+    io.closeInput()
+    return text.decode("utf-8")
+
+
+def write_file(path, size):
+    line = (u'{"name": "Document \u00e9", "command": ".uno:Open?URL:string='
+            u'file:///home/user/report.odt", "type": "item"},\n').encode("utf-8")
+    f = open(path, "wb")
+    try:
+        f.write(line * (size // len(line) + 1))
+    finally:
+        f.close()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1, 10, 50, 100]
+    benchenv.use_file_access()
+    manager = benchenv.new_manager("")
+    dir_path = tempfile.mkdtemp()
+    try:
+        print("seconds to read and decode")
+        print("%8s %10s %10s %10s" % ("MB", "local", "stream", "concat"))
+        for size in sizes:
+            path = os.path.join(dir_path, "bookmarks%d.json" % size)
+            write_file(path, size * 1048576)
+            local_url = "file://" + path
+            stream_url = benchenv.FileAccess.url(path)
+            local = benchenv.best_of(
+                lambda: manager._read_from_file(local_url))
+            stream = benchenv.best_of(
+                lambda: manager._read_from_file(stream_url))
+            if size <= CONCAT_LIMIT:
+                concat = "%10.3f" % benchenv.best_of(
+                    lambda: read_concat(stream_url), 1)
+            else:
+                concat = "%10s" % "-"
+            print("%8d %10.3f %10.3f %s" % (size, local, stream, concat))
+            os.remove(path)
+    finally:
+        shutil.rmtree(dir_path)
+
+
+if __name__ == "__main__":
+    main()
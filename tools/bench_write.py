@@ -0,0 +1,113 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+""" Latency and memory to save bookmarks file of 50 MB.
+
+    The writer of the manager is measured for local file and for file
+    written through SimpleFileAccess, the writer which removed the file
+    and wrote slices of the data, as it was before, is measured too.
+    Memory is the peak of allocations while writing. Whole saving of 
+    bookmarks having the similar size is measured at last.
+
+    python tools/bench_write.py [size in MB]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+import benchenv
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def write_slices(file_url, text):
+    """ Writer before the temporary file is used. """
+    import uno
+    sfa = benchenv.FileAccess()
+    if sfa.exists(file_url):
+        sfa.kill(file_url)
+    io = sfa.openFileWrite(file_url)
+    total = len(text) - 1
+    n = 0
+    while True:
+        io.writeBytes(uno.ByteSequence(text[n:n+0xffff]))
+        n += 0xffff
+        if n >= total:
+            break
+    io.closeOutput()
+
+
+def peak_of(fn):
+    """ Returns peak bytes allocated while the function is called. """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    size = 50
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    benchenv.use_file_access()
+    manager = benchenv.new_manager("")
+    line = b'{"name": "Document", "command": ".uno:Open?URL:string=' \
+        b'file:///home/user/report.odt", "type": "item"},\n'
+    text = line * (size * 1048576 // len(line) + 1)
+    dir_path = tempfile.mkdtemp()
+    try:
+        path = os.path.join(dir_path, "bookmarks.json")
+        local_url = "file://" + path
+        stream_url = benchenv.FileAccess.url(path)
+        writers = (
+            ("local", lambda: manager._write_to_file(local_url, text)),
+            ("stream", lambda: manager._write_to_file(stream_url, text)),
+            ("slices", lambda: write_slices(stream_url, text)),
+        )
+        print("%d MB" % (len(text) // 1048576))
+        print("%8s %10s %10s" % ("writer", "seconds", "peak MB"))
+        for name, writer in writers:
+            seconds = benchenv.best_of(writer)
+            peak = peak_of(writer)
+            if peak is None:
+                peak = "%10s" % "-"
+            else:
+                peak = "%10.1f" % (peak / 1048576.0)
+            print("%8s %10.3f %s" % (name, seconds, peak))
+        del text
+        tags, base, unsorted = benchenv.build_tree(size * 1048576 // 200)
+        manager = benchenv.new_manager(local_url)
+        manager.tags = tags
+        manager.base = base
+        manager.unsorted = unsorted
+        def store():
+            manager.modified = True
+            manager.store()
+        seconds = benchenv.best_of(store)
+        print("%8s %10.3f %10s  %d MB" % ("store", seconds, "-", 
+            os.path.getsize(path) // 1048576))
+    finally:
+        shutil.rmtree(dir_path)
+
+
+if __name__ == "__main__":
+    main()
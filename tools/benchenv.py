@@ -0,0 +1,235 @@
+#  Copyright 2012 Tsutomu Uchino
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+""" Environment to run benchmarks of the extension outside the office.
+
+    Modules are imported from pythonpath of the source tree. When the
+    python of the office is not used, modules of UNO are replaced with
+    minimal ones which are enough for the bookmarks without windows.
+"""
+
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "pythonpath"))
+
+UNO_MODULES = (
+    "com", "com.sun", "com.sun.star",
+    "com.sun.star.awt", "com.sun.star.awt.Key",
+    "com.sun.star.awt.KeyModifier", "com.sun.star.awt.MouseButton",
+    "com.sun.star.awt.PosSize", "com.sun.star.awt.grid",
+    "com.sun.star.awt.tree", "com.sun.star.beans",
+    "com.sun.star.container", "com.sun.star.frame",
+    "com.sun.star.lang", "com.sun.star.task", "com.sun.star.ucb",
+    "com.sun.star.ui", "com.sun.star.ui.dialogs",
+    "com.sun.star.ui.dialogs.ExtendedFilePickerElementIds",
+    "com.sun.star.ui.dialogs.TemplateDescription",
+    "com.sun.star.uno", "com.sun.star.util", "com.sun.star.view",
+)
+
+
+class UnoModule(types.ModuleType):
+    """ Returns new type for any name imported from the module. """
+    
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        value = type(name, (object,), {})
+        setattr(self, name, value)
+        return value
+
+
+class ByteSequence(object):
+    """ Keeps bytes as uno.ByteSequence. """
+    
+    def __init__(self, value):
+        self.value = value
+    
+    def __len__(self):
+        return len(self.value)
+
+
+def install_uno():
+    """ Install replacements of UNO modules if uno is not found. """
+    try:
+        import uno
+        return False
+    except ImportError:
+        pass
+    try:
+        from urllib.parse import quote, unquote
+    except ImportError:
+        from urllib import quote, unquote
+    uno = types.ModuleType("uno")
+    uno.fileUrlToSystemPath = lambda url: unquote(url[len("file://"):])
+    uno.systemPathToFileUrl = lambda path: "file://" + quote(path)
+    uno.ByteSequence = ByteSequence
+    uno.getConstantByName = lambda name: 0
+    sys.modules["uno"] = uno
+    unohelper = types.ModuleType("unohelper")
+    unohelper.Base = type("Base", (object,), {})
+    unohelper.systemPathToFileUrl = uno.systemPathToFileUrl
+    unohelper.fileUrlToSystemPath = uno.fileUrlToSystemPath
+    sys.modules["unohelper"] = unohelper
+    for name in UNO_MODULES:
+        sys.modules[name] = UnoModule(name)
+    return True
+
+
+install_uno()
+
+
+class InputStream(object):
+    """ Input stream of FileAccess. """
+    
+    def __init__(self, f):
+        self.f = f
+        self.calls = 0
+    
+    def readBytes(self, data, size):
+        self.calls += 1
+        value = self.f.read(size)
+        return len(value), ByteSequence(value)
+    
+    def closeInput(self):
+        self.f.close()
+
+
+class OutputStream(object):
+    """ Output stream of FileAccess. """
+    
+    def __init__(self, f):
+        self.f = f
+        self.calls = 0
+    
+    def writeBytes(self, data):
+        self.calls += 1
+        self.f.write(data.value)
+    
+    def flush(self):
+        self.f.flush()
+    
+    def closeOutput(self):
+        self.f.close()
+
+
+class FileAccess(object):
+    """ SimpleFileAccess for local files having URL of SCHEME, they are 
+        read and written in the way for files not on the local file 
+        system. """
+    
+    SCHEME = "vnd.bench://"
+    
+    def url(path):
+        return FileAccess.SCHEME + path
+    
+    url = staticmethod(url)
+    
+    def path(self, url):
+        return url[len(self.SCHEME):]
+    
+    def openFileRead(self, url):
+        return InputStream(open(self.path(url), "rb"))
+    
+    def openFileWrite(self, url):
+        return OutputStream(open(self.path(url), "wb"))
+    
+    def getSize(self, url):
+        return os.path.getsize(self.path(url))
+    
+    def exists(self, url):
+        return os.path.exists(self.path(url))
+    
+    def kill(self, url):
+        os.remove(self.path(url))
+    
+    def move(self, source, dest):
+        os.rename(self.path(source), self.path(dest))
+
+
+def use_file_access():
+    """ Let the extension use FileAccess as SimpleFileAccess. """
+    import bookmarks.tools
+    create_service = bookmarks.tools.create_service
+    def _create_service(ctx, name, *args):
+        if name == "com.sun.star.ucb.SimpleFileAccess":
+            return FileAccess()
+        return create_service(ctx, name, *args)
+    bookmarks.tools.create_service = _create_service
+
+
+def best_of(fn, repeat=3):
+    """ Returns the shortest seconds of calls of the function. """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        fn()
+        spent = time.time() - start
+        if best is None or spent < best:
+            best = spent
+    return best
+
+
+def build_tree(count, folder_size=100, tag_count=20):
+    """ Build synthetic bookmarks having count items.
+        Returns tuple of tags, base and unsorted containers. """
+    from bookmarks.bookmark import Container, Item, Separator, TagContainer
+    base = Container("Bookmarks")
+    base.id = 1
+    folder = None
+    for i in range(count):
+        if i % folder_size == 0:
+            folder = Container("Folder %d" % (i // folder_size))
+            base.children.append(folder)
+        folder.children.append(Item(
+            "Document %d" % i, "",
+            ".uno:Open?URL:string=file:///home/user/Documents/"
+            "project%d/report_%d.odt&FilterName:string=writer8" %
+                (i // folder_size, i),
+            ["tag%d" % (i % tag_count)]))
+        if i % folder_size == folder_size - 1:
+            folder.children.append(Separator())
+    unsorted = Container("Unsorted Bookmarks")
+    unsorted.id = -1
+    tags = dict([("tag%d" % i, TagContainer("tag%d" % i, ""))
+                    for i in range(tag_count)])
+    return tags, base, unsorted
+
+
+def new_manager(file_url):
+    """ Returns manager of the file without reading it. """
+    import threading
+    from bookmarks.manager import BookmarksManager
+    from bookmarks.bookmark import BookmarksManagerBase
+    manager = BookmarksManager.__new__(BookmarksManager)
+    BookmarksManagerBase.__init__(manager)
+    manager.ctx = None
+    manager.command = ""
+    manager.file_url = file_url
+    manager.bookmark_name = ""
+    manager.unsorted = None
+    manager.modified = False
+    manager.last_modified = 0
+    manager.load_phases = []
+    manager.database = None
+    manager.journal = None
+    manager.backups = None
+    manager.store_lock = threading.Lock()
+    manager.compression = BookmarksManager.compression_for(file_url)
+    manager.USE_JOURNAL = False
+    manager.backup = lambda: None
+    return manager